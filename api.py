@@ -1,50 +1,125 @@
-from fastapi import FastAPI, Depends, Request, HTTPException, Form
-from fastapi.responses import Response, RedirectResponse, FileResponse
+from fastapi import FastAPI, Depends, Request, HTTPException, Form, Query, UploadFile
+from fastapi.responses import Response, HTMLResponse, JSONResponse, RedirectResponse, StreamingResponse
 from fastapi.security import OAuth2PasswordRequestForm
-from fastapi.exceptions import HTTPException
-from fastapi.staticfiles import StaticFiles
+from fastapi.encoders import jsonable_encoder
+from fastapi.exceptions import HTTPException, RequestValidationError
 from fastapi.templating import Jinja2Templates
+from markupsafe import Markup, escape
 import uvicorn
 
-from typing import Annotated
+from typing import Annotated, AsyncIterator, Awaitable, BinaryIO, Callable, Hashable, Iterator, Literal, Optional
 from pathlib import Path
-
-from flashlearn.deps import get_current_user, get_user_handler, ensure_not_logged_in, get_set_handler
+from contextlib import asynccontextmanager
+from email.utils import formatdate
+import asyncio
+import csv
+import gzip
+import hashlib
+import io
+import itertools
+import json
+import logging
+import shutil
+import tempfile
+
+from flashlearn.deps import create_token_async, get_current_user, get_fresh_user, get_user_handler, ensure_not_logged_in, get_set_handler, get_study_handler
+from flashlearn.security.token import SESSION_TTL
 from flashlearn.utils.user_handler import UserHandler
-from flashlearn.utils.set_handler import SetHandler
-from flashlearn.utils.database import DatabaseManager
+from flashlearn.utils.set_handler import AsyncSetHandler, EXPORT_COLUMNS, MAX_PAGE_SIZE, PAGE_SIZE, SEARCH_PAGE_SIZE, page_cache
+from flashlearn.utils.study_handler import AsyncStudyHandler, StudyHandler, MAX_REVIEW_BATCH
+from flashlearn.utils.scheduler import GRADES
+from flashlearn.utils.database import DatabaseManager, run_in_pool, run_in_writer
+from flashlearn.utils.assets import FingerprintedStaticFiles
+from flashlearn.utils.log import LOGGER_NAME, configure_logging
+from flashlearn.utils.cache import report_stats
 from flashlearn.models.user import User
-
-app = FastAPI()
-app.mount("/assets", StaticFiles(directory=Path("./interface/assets").resolve()), name="assets")
+from flashlearn.models.study import Review, StudyStep
+from flashlearn.models.search import MATCH_END, MATCH_START
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Cache hit and miss counters are only reported with DEBUG logging
+    task = None
+    if logging.getLogger(LOGGER_NAME).isEnabledFor(logging.DEBUG):
+        task = asyncio.create_task(report_stats())
+    yield
+    if task is not None:
+        task.cancel()
+
+app = FastAPI(lifespan=lifespan)
+
+@app.exception_handler(RequestValidationError)
+async def validation_error(request: Request, exc: RequestValidationError):
+    # Like FastAPI's own handler without echoing the rejected input, which cannot be encoded
+    # as JSON when it is NaN or infinite, e.g. a Review timestamp
+    errors = [{key: value for key, value in error.items() if key != "input"} for error in exc.errors()]
+    return JSONResponse(status_code=422, content={"detail": jsonable_encoder(errors)})
+# Assets are fingerprinted and precompressed once here, templates link them with asset_url
+assets = FingerprintedStaticFiles(directory=Path("./interface/assets").resolve())
+app.mount("/assets", assets, name="assets")
 templates = Jinja2Templates(directory=Path("./interface").resolve())
+templates.env.globals["asset_url"] = assets.asset_url
+
+def highlight(text: Optional[str]) -> Markup:
+    # Escape the card's text, then turn the search match markers into <mark> tags
+    return escape(text or "").replace(MATCH_START, Markup("<mark>")).replace(MATCH_END, Markup("</mark>"))
+
+templates.env.filters["highlight"] = highlight
+
+# Logging is off unless FLASHLEARN_LOG_LEVEL is set
+configure_logging()
 
 # Ensure database is created
 DatabaseManager()
+# Recompute due dates if the FLASHLEARN_SM2_* parameters changed since the last start
+StudyHandler().apply_params()
+
+def set_session_cookie(response: Response, token: str):
+    response.set_cookie(key="access_token", value=f'bearer {token}', max_age=SESSION_TTL, httponly=True, samesite="lax")
+
+# Issue a signed session token and store it in the cookie read by OAuth2WithCookie
+async def start_session(response: Response, user: User) -> dict:
+    token = await create_token_async(user)
+    set_session_cookie(response, token)
+    return {"access_token": token, "token_type": "bearer"}
+
+@app.middleware("http")
+async def renew_session_cookie(request: Request, call_next):
+    # get_current_user renewed a stale token, hand the new one to the browser unless the
+    # route already set or cleared the cookie itself
+    response = await call_next(request)
+    token = getattr(request.state, "session_token", None)
+    if token is not None and not any(key == b"set-cookie" and value.startswith(b"access_token=") for key, value in response.raw_headers):
+        set_session_cookie(response, token)
+    return response
 
 # Token route for user authentication
 @app.post("/token")
-def login_token(form: Annotated[OAuth2PasswordRequestForm, Depends()], handler: Annotated[UserHandler, Depends(get_user_handler)], response: Response):
-    user = handler.login(form.username, form.password)
+async def login_token(form: Annotated[OAuth2PasswordRequestForm, Depends()], handler: Annotated[UserHandler, Depends(get_user_handler)], response: Response):
+    user = await handler.login(form.username, form.password)
     if user is None:
         raise HTTPException(status_code=401, detail="Invalid username or password", headers={"WWW-Authenticate": "Bearer"})
-    response.set_cookie(key="access_token", value=f'bearer {user.email}')
-    return {"access_token": user.email, "token_type": "bearer"}
+    return await start_session(response, user)
+
+# Re-read the user from the database and issue a new token
+@app.post("/token/refresh")
+async def refresh_token(user: Annotated[User, Depends(get_fresh_user)], response: Response):
+    return await start_session(response, user)
 
 # Root page
 @app.get("/")
-def landing_page(request: Request):
+async def landing_page(request: Request):
     return templates.TemplateResponse("root.html", {"request": request})
 
 @app.get('/favicon.ico')
-async def favicon():
-    file_name = "favicon.ico"
-    return FileResponse(Path(f"./interface/assets/{file_name}"), headers={"Content-Disposition": "attachment; filename=" + file_name})
+async def favicon(request: Request):
+    # Served inline from memory, its URL is fixed so browsers revalidate it once a day
+    return assets.get("favicon.ico").response(request.headers, cache_control="public, max-age=86400")
 
 
 # Login page
 @app.get("/login")
-def login_page(logged_in: Annotated[bool, Depends(ensure_not_logged_in)], request: Request):
+async def login_page(logged_in: Annotated[bool, Depends(ensure_not_logged_in)], request: Request):
 
     if logged_in:
         return RedirectResponse(url="/home")
@@ -52,7 +127,7 @@ def login_page(logged_in: Annotated[bool, Depends(ensure_not_logged_in)], reques
     return templates.TemplateResponse("login.html", {"request": request})
 
 @app.post("/login")
-def login(form: Annotated[OAuth2PasswordRequestForm, Depends()],
+async def login(form: Annotated[OAuth2PasswordRequestForm, Depends()],
           handler: Annotated[UserHandler, Depends(get_user_handler)], 
           logged_in: Annotated[bool, Depends(ensure_not_logged_in)],
           response: Response):
@@ -60,16 +135,15 @@ def login(form: Annotated[OAuth2PasswordRequestForm, Depends()],
     if logged_in:
         return RedirectResponse(url="/home")
     
-    user = handler.login(form.username, form.password)
+    user = await handler.login(form.username, form.password)
     if user is None:
         raise HTTPException(status_code=401, detail="Invalid username or password", headers={"WWW-Authenticate": "Bearer"})
-    response.set_cookie(key="access_token", value=f'bearer {user.email}')
-    return {"access_token": user.email, "token_type": "bearer"}
+    return await start_session(response, user)
 
 
 # Register page
 @app.get("/register")
-def register_page(logged_in: Annotated[bool, Depends(ensure_not_logged_in)], request: Request):
+async def register_page(logged_in: Annotated[bool, Depends(ensure_not_logged_in)], request: Request):
 
     if logged_in:
         return RedirectResponse(url="/home")
@@ -77,7 +151,7 @@ def register_page(logged_in: Annotated[bool, Depends(ensure_not_logged_in)], req
     return templates.TemplateResponse("register.html", {"request": request})
 
 @app.post("/register")
-def register(handler: Annotated[UserHandler, Depends(get_user_handler)], 
+async def register(handler: Annotated[UserHandler, Depends(get_user_handler)], 
              logged_in: Annotated[bool, Depends(ensure_not_logged_in)],
              response: Response, username: str = Form(), password: str = Form(), 
              email: str = Form()):
@@ -85,205 +159,381 @@ def register(handler: Annotated[UserHandler, Depends(get_user_handler)],
     if logged_in:
         return RedirectResponse(url="/home")
     
-    user = handler.register(username, password, email)
+    user = await handler.register(username, password, email)
     # If user is None, registration failed
     if user is None:
         raise HTTPException(status_code=500, detail="Failed to register user")
-    response.set_cookie(key="access_token", value=f'bearer {user.email}')
-    return {"access_token": user.email, "token_type": "bearer"}
+    return await start_session(response, user)
 
 
 # Home page
 @app.get("/home")
-def home_page(request: Request, user: Annotated[User, Depends(get_current_user)]):
+async def home_page(request: Request, user: Annotated[User, Depends(get_current_user)]):
     return templates.TemplateResponse("home.html", {"request": request, "user": user})
 
 @app.post("/home")
-def home_page_post(request: Request, user: Annotated[User, Depends(get_current_user)]):
+async def home_page_post(request: Request, user: Annotated[User, Depends(get_current_user)]):
     return templates.TemplateResponse("home.html", {"request": request, "user": user})
 
 # Logout
 @app.get("/logout")
-def logout():
+async def logout():
     response = RedirectResponse(url="/login")
     response.delete_cookie(key="access_token")
     return response
 
 # Profile page
 @app.get("/profile")
-def profile_page(request: Request, user: Annotated[User, Depends(get_current_user)]):
+async def profile_page(request: Request, user: Annotated[User, Depends(get_current_user)]):
     return templates.TemplateResponse("profile.html", {"request": request, "user": user})
 
 @app.post("/profile")
-def profile_page_post(request: Request, user: Annotated[User, Depends(get_current_user)]):
+async def profile_page_post(request: Request, user: Annotated[User, Depends(get_current_user)]):
     return templates.TemplateResponse("profile.html", {"request": request, "user": user})
 
 @app.post("/new_password")
-def new_password(current_password: str, password: str, 
-                 user: Annotated[User, Depends(get_current_user)], 
-                 handler: Annotated[UserHandler, Depends(get_user_handler)]):
-    if not handler.login(user.email, current_password):
+async def new_password(user: Annotated[User, Depends(get_current_user)], 
+                       handler: Annotated[UserHandler, Depends(get_user_handler)],
+                       current_password: str = Form(), password: str = Form()):
+    user = await handler.change_password(user.email, current_password, password)
+    if user is None:
         raise HTTPException(status_code=401, detail="Invalid current password")
-    handler.change_password(user.email, password)
-    return RedirectResponse(url="/profile")
+    # Other sessions end with the old epoch, this one continues under the new one
+    response = RedirectResponse(url="/profile")
+    await start_session(response, user)
+    return response
+
+def page_nonce() -> str:
+    # Hash of everything a page is rendered from besides the database, so every worker of a
+    # deploy agrees on it, while a deploy changing a template or an asset, whose fingerprint
+    # pages link, never matches pages rendered before it
+    digest = hashlib.sha256(Path(__file__).read_bytes())
+    for path in sorted(Path("./interface").rglob("*.html")):
+        digest.update(path.as_posix().encode())
+        digest.update(path.read_bytes())
+    digest.update(json.dumps(assets.urls, sort_keys=True).encode())
+    return digest.hexdigest()[:16]
+
+PAGE_NONCE = page_nonce()
+
+def page_etag(user_id: int, version: int) -> str:
+    # Weak like deck_etag
+    return f'W/"page-{PAGE_NONCE}-{user_id}-{version}"'
+
+async def cached_page(request: Request, user: User, handler: AsyncSetHandler, key: Hashable,
+                      render: Callable[[], Awaitable[Response]]) -> Response:
+    # Pages are cached under the user's page version, so a repeat view costs one primary key
+    # lookup and a browser that already holds the current version gets a 304
+    version, modified = await handler.get_page_version(user.id)
+    headers = {"Cache-Control": "private, no-cache", "ETag": page_etag(user.id, version),
+               "Last-Modified": formatdate(modified, usegmt=True)}
+    if request.headers.get("if-none-match") == headers["ETag"]:
+        return Response(status_code=304, headers=headers)
+    body = page_cache.get((user.id, version, key))
+    if body is None:
+        body = (await render()).body
+        page_cache.set((user.id, version, key), body)
+    return HTMLResponse(body, headers=headers)
 
 # Get user sets
 @app.get("/sets")
-def get_sets(request: Request, user: Annotated[User, Depends(get_current_user)], 
-             handler: Annotated[SetHandler, Depends(get_set_handler)]):
-    sets = handler.get_user_sets(user.id)
-    return templates.TemplateResponse("sets.html", {"request": request, "sets": sets, "user": user})
+async def get_sets(request: Request, user: Annotated[User, Depends(get_current_user)], 
+                   handler: Annotated[AsyncSetHandler, Depends(get_set_handler)]):
+    async def render():
+        sets = await handler.get_user_set_summaries(user.id)
+        return templates.TemplateResponse("sets.html", {"request": request, "sets": sets, "user": user})
+    return await cached_page(request, user, handler, ("sets",), render)
 
 @app.post("/sets")
-def get_sets_post(request: Request, user: Annotated[User, Depends(get_current_user)],
-                    handler: Annotated[SetHandler, Depends(get_set_handler)]):
-        sets = handler.get_user_sets(user.id)
-        return templates.TemplateResponse("sets.html", {"request": request, "sets": sets, "user": user})
+async def get_sets_post(request: Request, user: Annotated[User, Depends(get_current_user)],
+                    handler: Annotated[AsyncSetHandler, Depends(get_set_handler)]):
+        return await get_sets(request, user, handler)
 
 # Get set
 @app.get("/set/{set_id}")
-def get_set(request: Request, set_id: int, user: Annotated[User, Depends(get_current_user)], handler: Annotated[SetHandler, Depends(get_set_handler)]):
-    set = handler.get_set(set_id)
-    return templates.TemplateResponse("set.html", {"request": request, "set": set, "user": user})
+async def get_set(request: Request, set_id: int, user: Annotated[User, Depends(get_current_user)], handler: Annotated[AsyncSetHandler, Depends(get_set_handler)],
+                  after: Annotated[int, Query(ge=0)] = 0, limit: Annotated[int, Query(ge=1, le=MAX_PAGE_SIZE)] = PAGE_SIZE):
+    async def render():
+        set = await handler.get_set(set_id, user.id, after, limit)
+        if set is None:
+            raise HTTPException(status_code=404, detail="Set not found")
+        return templates.TemplateResponse("set.html", {"request": request, "set": set, "user": user, "after": after, "limit": limit})
+    return await cached_page(request, user, handler, ("set", set_id, after, limit), render)
 
 @app.post("/set/{set_id}")
-def get_set_post(request: Request, set_id: int, user: Annotated[User, Depends(get_current_user)], handler: Annotated[SetHandler, Depends(get_set_handler)]):
-    set = handler.get_set(set_id)
-    return templates.TemplateResponse("set.html", {"request": request, "set": set, "user": user})
+async def get_set_post(request: Request, set_id: int, user: Annotated[User, Depends(get_current_user)], handler: Annotated[AsyncSetHandler, Depends(get_set_handler)],
+                       after: Annotated[int, Query(ge=0)] = 0, limit: Annotated[int, Query(ge=1, le=MAX_PAGE_SIZE)] = PAGE_SIZE):
+    return await get_set(request, set_id, user, handler, after, limit)
 
 # Get super set
 @app.get("/super_set/{super_id}")
-def get_super_set(request: Request, super_id: int, user: Annotated[User, Depends(get_current_user)], handler: Annotated[SetHandler, Depends(get_set_handler)]):
-    super_set = handler.get_super_set(super_id)
-    return templates.TemplateResponse("super_set.html", {"request": request, "super_set": super_set, "user": user})
+async def get_super_set(request: Request, super_id: int, user: Annotated[User, Depends(get_current_user)], handler: Annotated[AsyncSetHandler, Depends(get_set_handler)],
+                        after: Annotated[int, Query(ge=0)] = 0, limit: Annotated[int, Query(ge=1, le=MAX_PAGE_SIZE)] = PAGE_SIZE):
+    async def render():
+        super_set = await handler.get_super_set(super_id, user.id, after, limit)
+        if super_set is None:
+            raise HTTPException(status_code=404, detail="Super set not found")
+        return templates.TemplateResponse("super_set.html", {"request": request, "super_set": super_set, "user": user, "after": after, "limit": limit})
+    return await cached_page(request, user, handler, ("super_set", super_id, after, limit), render)
 
 @app.post("/super_set/{super_id}")
-def get_super_set_post(request: Request, super_id: int, user: Annotated[User, Depends(get_current_user)], handler: Annotated[SetHandler, Depends(get_set_handler)]):
-    super_set = handler.get_super_set(super_id)
-    return templates.TemplateResponse("super_set.html", {"request": request, "super_set": super_set, "user": user})
+async def get_super_set_post(request: Request, super_id: int, user: Annotated[User, Depends(get_current_user)], handler: Annotated[AsyncSetHandler, Depends(get_set_handler)],
+                             after: Annotated[int, Query(ge=0)] = 0, limit: Annotated[int, Query(ge=1, le=MAX_PAGE_SIZE)] = PAGE_SIZE):
+    return await get_super_set(request, super_id, user, handler, after, limit)
 
 # Create set
 @app.get("/create_set")
-def create_set_page(request: Request, user: Annotated[User, Depends(get_current_user)]):
+async def create_set_page(request: Request, user: Annotated[User, Depends(get_current_user)]):
     return templates.TemplateResponse("create_set.html", {"request": request, "user": user})
 
 @app.post("/create_set")
-def create_set(user: Annotated[User, Depends(get_current_user)], handler: Annotated[SetHandler, Depends(get_set_handler)],
+async def create_set(user: Annotated[User, Depends(get_current_user)], handler: Annotated[AsyncSetHandler, Depends(get_set_handler)],
                 name: str = Form()):
-    handler.create_set(name, user.id)
+    await handler.create_set(name, user.id)
     return RedirectResponse(url="/sets")
 
 # Subset creation
 @app.get("/create_set/{super_id}")
-def create_set_page(request: Request, super_id: int, user: Annotated[User, Depends(get_current_user)]):
+async def create_set_page(request: Request, super_id: int, user: Annotated[User, Depends(get_current_user)]):
     return templates.TemplateResponse("create_set.html", {"request": request, "user": user, "super_id": super_id})
 
 @app.post("/create_set/{super_id}")
-def create_set(super_id: int, user: Annotated[User, Depends(get_current_user)], 
-                handler: Annotated[SetHandler, Depends(get_set_handler)], name: str = Form()):
-    handler.create_set(name, user.id, super_id)
+async def create_set(super_id: int, user: Annotated[User, Depends(get_current_user)], 
+                handler: Annotated[AsyncSetHandler, Depends(get_set_handler)], name: str = Form()):
+    await handler.create_set(name, user.id, super_id)
     return RedirectResponse(url=f"/super_set/{super_id}")
 
 # Create super set
 @app.get("/create_super_set")
-def create_super_set_page(request: Request, user: Annotated[User, Depends(get_current_user)]):
+async def create_super_set_page(request: Request, user: Annotated[User, Depends(get_current_user)]):
     return templates.TemplateResponse("create_super_set.html", {"request": request, "user": user})
 
 @app.post("/create_super_set")
-def create_super_set(user: Annotated[User, Depends(get_current_user)], handler: Annotated[SetHandler, Depends(get_set_handler)],
-                     name: str = Form()):
-    handler.create_super_set(name, user.id)
+async def create_super_set(user: Annotated[User, Depends(get_current_user)], handler: Annotated[AsyncSetHandler, Depends(get_set_handler)],
+                           name: str = Form()):
+    await handler.create_super_set(name, user.id)
     return RedirectResponse(url="/sets")
 
 # Create flashcard
 @app.get("/create_flashcard/{set_id}")
-def create_flashcard_page(request: Request, set_id: int, user: Annotated[User, Depends(get_current_user)]):
+async def create_flashcard_page(request: Request, set_id: int, user: Annotated[User, Depends(get_current_user)]):
     return templates.TemplateResponse("create_flashcard.html", {"request": request, "user": user, "set_id": set_id})
 
 @app.post("/create_flashcard/{set_id}")
-def create_flashcard(set_id: int, term: Annotated[str, Form()], body: Annotated[str, Form()],
-                     user: Annotated[User, Depends(get_current_user)], handler: Annotated[SetHandler, Depends(get_set_handler)]):
+async def create_flashcard(set_id: int, term: Annotated[str, Form()], body: Annotated[str, Form()],
+                           user: Annotated[User, Depends(get_current_user)], handler: Annotated[AsyncSetHandler, Depends(get_set_handler)]):
     # Create flashcard
-    handler.add_card_to_set(set_id, user.email, term, body)
+    await handler.add_card_to_set(set_id, user.id, term, body)
     return RedirectResponse(url=f"/set/{set_id}")
 
+# Uploads up to this size are copied in memory, larger ones to a temporary file
+UPLOAD_SPOOL_SIZE = 1024 * 1024
+
+async def import_progress(set_id: int, cards: Iterator[int], upload: BinaryIO) -> AsyncIterator[str]:
+    # The import generator holds a transaction on its thread's connection, so the writer
+    # thread consumes it whole, keeping the read pool free, and hands the count after each
+    # batch over a queue
+    loop = asyncio.get_running_loop()
+    counts = asyncio.Queue()
+    def consume():
+        with upload:
+            for count in cards:
+                loop.call_soon_threadsafe(counts.put_nowait, count)
+    task = asyncio.ensure_future(run_in_writer(consume))
+    task.add_done_callback(lambda _: counts.put_nowait(None))
+    imported = 0
+    while (count := await counts.get()) is not None:
+        imported = count
+        yield json.dumps({"set_id": set_id, "imported": count, "done": False}) + "\n"
+    if task.exception() is not None:
+        # The batches commit together, a failed import leaves the set unchanged
+        yield json.dumps({"set_id": set_id, "imported": 0, "done": True, "error": "Import failed"}) + "\n"
+    else:
+        yield json.dumps({"set_id": set_id, "imported": imported, "done": True}) + "\n"
+
+# Import flashcards from a CSV or TSV file, streaming NDJSON progress lines unless posted by the HTML form
+@app.post("/import_flashcards/{set_id}")
+async def import_flashcards(request: Request, set_id: int, file: UploadFile, user: Annotated[User, Depends(get_current_user)],
+                            handler: Annotated[AsyncSetHandler, Depends(get_set_handler)]):
+    # Only into the user's own sets
+    if await handler.get_deck_version(user.id, "set", set_id) is None:
+        raise HTTPException(status_code=404, detail="Set not found")
+    delimiter = "\t" if Path(file.filename or "").suffix.lower() in (".tsv", ".txt") else ","
+    # The upload is closed once this route returns, while the streamed import reads its own copy
+    upload = tempfile.SpooledTemporaryFile(max_size=UPLOAD_SPOOL_SIZE)
+    await run_in_pool(shutil.copyfileobj, file.file, upload)
+    upload.seek(0)
+    progress = import_progress(set_id, handler.sync.import_cards(set_id, user.id, upload, delimiter), upload)
+    if "text/html" in request.headers.get("accept", ""):
+        async for line in progress:
+            pass
+        if "error" in json.loads(line):
+            raise HTTPException(status_code=400, detail="Import failed, the set was left unchanged")
+        return RedirectResponse(url=f"/set/{set_id}")
+    return StreamingResponse(progress, media_type="application/x-ndjson")
+
+# Export sets as CSV or JSON Lines
+def csv_lines(rows: Iterator[tuple]) -> Iterator[str]:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for values in itertools.chain([EXPORT_COLUMNS], rows):
+        writer.writerow(values)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+
+def json_lines(rows: Iterator[tuple]) -> Iterator[str]:
+    for values in rows:
+        yield json.dumps(dict(zip(EXPORT_COLUMNS, values))) + "\n"
+
+@app.get("/export")
+async def export_sets(user: Annotated[User, Depends(get_current_user)], handler: Annotated[AsyncSetHandler, Depends(get_set_handler)],
+                      format: Literal["csv", "jsonl"] = "csv", set_id: Optional[int] = None, super_id: Optional[int] = None):
+    rows = await handler.export_cards(user.id, set_id, super_id)
+    if format == "csv":
+        content, media_type = csv_lines(rows), "text/csv"
+    else:
+        content, media_type = json_lines(rows), "application/x-ndjson"
+    return StreamingResponse(content, media_type=media_type,
+                             headers={"Content-Disposition": f"attachment; filename=flashlearn.{format}"})
+
 # Edit set
 @app.get("/edit_set/{set_id}")
-def edit_set_page(request: Request, set_id: int, user: Annotated[User, Depends(get_current_user)], handler: Annotated[SetHandler, Depends(get_set_handler)]):
-    set = handler.get_set(set_id)
+async def edit_set_page(request: Request, set_id: int, user: Annotated[User, Depends(get_current_user)], handler: Annotated[AsyncSetHandler, Depends(get_set_handler)]):
+    set = await handler.get_set(set_id, user.id)
+    if set is None:
+        raise HTTPException(status_code=404, detail="Set not found")
     return templates.TemplateResponse("edit_set.html", {"request": request, "user": user, "set": set})
 
 @app.post("/edit_set/{set_id}")
-def edit_set(set_id: int, handler: Annotated[SetHandler, Depends(get_set_handler)], name: str = Form()):
-    handler.edit_set(set_id, name)
+async def edit_set(set_id: int, handler: Annotated[AsyncSetHandler, Depends(get_set_handler)], name: str = Form()):
+    await handler.edit_set(set_id, name)
     return RedirectResponse(url=f"/set/{set_id}")
 
 # Delete set
 @app.get("/delete_set/{set_id}")
-def delete_set_page(request: Request, set_id: int, user: Annotated[User, Depends(get_current_user)], handler: Annotated[SetHandler, Depends(get_set_handler)]):
-    handler.delete_set(set_id)
+async def delete_set_page(request: Request, set_id: int, user: Annotated[User, Depends(get_current_user)], handler: Annotated[AsyncSetHandler, Depends(get_set_handler)]):
+    await handler.delete_set(set_id)
     return RedirectResponse(url="/sets")
 
 # Delete super set
 @app.get("/delete_super_set/{super_id}")
-def delete_super_set_page(request: Request, super_id: int, user: Annotated[User, Depends(get_current_user)], handler: Annotated[SetHandler, Depends(get_set_handler)]):
-    handler.delete_super_set(super_id)
+async def delete_super_set_page(request: Request, super_id: int, user: Annotated[User, Depends(get_current_user)], handler: Annotated[AsyncSetHandler, Depends(get_set_handler)]):
+    await handler.delete_super_set(super_id)
     return RedirectResponse(url="/sets")
 
 # Edit super set
 @app.get("/edit_super_set/{super_id}")
-def edit_super_set_page(request: Request, super_id: int, user: Annotated[User, Depends(get_current_user)], handler: Annotated[SetHandler, Depends(get_set_handler)]):
-    super_set = handler.get_super_set(super_id)
+async def edit_super_set_page(request: Request, super_id: int, user: Annotated[User, Depends(get_current_user)], handler: Annotated[AsyncSetHandler, Depends(get_set_handler)]):
+    super_set = await handler.get_super_set(super_id, user.id)
+    if super_set is None:
+        raise HTTPException(status_code=404, detail="Super set not found")
     return templates.TemplateResponse("edit_super_set.html", {"request": request, "user": user, "super_set": super_set})
 
 @app.post("/edit_super_set/{super_id}")
-def edit_super_set(super_id: int, handler: Annotated[SetHandler, Depends(get_set_handler)], name: str = Form()):
-    handler.edit_super_set(super_id, name)
+async def edit_super_set(super_id: int, handler: Annotated[AsyncSetHandler, Depends(get_set_handler)], name: str = Form()):
+    await handler.edit_super_set(super_id, name)
     return RedirectResponse(url=f"/super_set/{super_id}")
 
 # Edit flashcard
 @app.get("/edit_flashcard/{card_id}")
-def edit_flashcard_page(request: Request, card_id: int, user: Annotated[User, Depends(get_current_user)], handler: Annotated[SetHandler, Depends(get_set_handler)]):
-    card = handler.get_card(card_id)
+async def edit_flashcard_page(request: Request, card_id: int, user: Annotated[User, Depends(get_current_user)], handler: Annotated[AsyncSetHandler, Depends(get_set_handler)]):
+    card = await handler.get_card(card_id)
     return templates.TemplateResponse("edit_flashcard.html", {"request": request, "user": user, "card": card})
 
 @app.post("/edit_flashcard/{card_id}")
-def edit_flashcard(card_id: int, handler: Annotated[SetHandler, Depends(get_set_handler)],
-                   term: Annotated[str | None, Form()], body: Annotated[str | None, Form()]):
-    card = handler.edit_card(card_id, term, body)
+async def edit_flashcard(card_id: int, handler: Annotated[AsyncSetHandler, Depends(get_set_handler)],
+                         term: Annotated[str | None, Form()], body: Annotated[str | None, Form()]):
+    card = await handler.edit_card(card_id, term, body)
     return RedirectResponse(url=f"/set/{card.set_id}")
 
 # Delete flashcard
 @app.get("/delete_flashcard/{card_id}")
-def delete_flashcard_page(request: Request, card_id: int, user: Annotated[User, Depends(get_current_user)], handler: Annotated[SetHandler, Depends(get_set_handler)]):
-    set_id = handler.get_card(card_id).set_id
-    handler.delete_card(card_id)
+async def delete_flashcard_page(request: Request, card_id: int, user: Annotated[User, Depends(get_current_user)], handler: Annotated[AsyncSetHandler, Depends(get_set_handler)]):
+    set_id = (await handler.get_card(card_id)).set_id
+    await handler.delete_card(card_id)
     return RedirectResponse(url=f"/set/{set_id}")
 
+# Search flashcards
+@app.get("/search")
+async def search_page(request: Request, user: Annotated[User, Depends(get_current_user)], handler: Annotated[AsyncSetHandler, Depends(get_set_handler)],
+                      q: str = "", page: Annotated[int, Query(ge=1)] = 1):
+    # One extra result tells whether there is a next page
+    results = await handler.search_cards(user.id, q, SEARCH_PAGE_SIZE + 1, (page - 1) * SEARCH_PAGE_SIZE)
+    return templates.TemplateResponse("search.html", {"request": request, "user": user, "query": q, "page": page,
+                                                      "results": results[:SEARCH_PAGE_SIZE], "has_next": len(results) > SEARCH_PAGE_SIZE})
+
 # Study mode
 @app.get("/study/new_session/{set_id}")
-def new_study_session(request: Request, set_id: int, user: Annotated[User, Depends(get_current_user)], handler: Annotated[SetHandler, Depends(get_set_handler)]):
-    card = handler.get_next_unstudied_card(set_id=set_id)
-    if card is None:
+async def new_study_session(set_id: int, user: Annotated[User, Depends(get_current_user)], handler: Annotated[AsyncStudyHandler, Depends(get_study_handler)]):
+    session_id = await handler.start_session(user.id, set_id)
+    if session_id is None:
         return RedirectResponse(url="/sets")
-    return RedirectResponse(url=f"/study/{card.id}")
-
-@app.get("/study/{card_id}")
-def study_page(request: Request, card_id: int, user: Annotated[User, Depends(get_current_user)], handler: Annotated[SetHandler, Depends(get_set_handler)]):
-    card = handler.get_card(card_id)
-    return templates.TemplateResponse("study.html", {"request": request, "user": user, "card": card})
-
-@app.get("/study/studied/{card_id}")
-def mark_card_as_studied(card_id: int, handler: Annotated[SetHandler, Depends(get_set_handler)]):
-    card = handler.study_card(card_id)
-    return RedirectResponse(url=f"/study/new_card/{card.id}")
-
-@app.get("/study/new_card/{card_id}")
-def get_next_unstudied_card(card_id: int, handler: Annotated[SetHandler, Depends(get_set_handler)]):
-    next_card = handler.get_next_unstudied_card(card_id=card_id)
-    if next_card is None:
+    return RedirectResponse(url=f"/study/session/{session_id}")
+
+def render_study_step(request: Request, user: User, step: Optional[StudyStep]):
+    # Finished sessions go back to the set overview
+    if step is None:
         return RedirectResponse(url="/sets")
-    return RedirectResponse(url=f"/study/{next_card.id}")
+    return templates.TemplateResponse("study.html", {"request": request, "user": user, "step": step, "card": step.card})
+
+@app.get("/study/session/{session_id}")
+async def study_page(request: Request, session_id: int, user: Annotated[User, Depends(get_current_user)], handler: Annotated[AsyncStudyHandler, Depends(get_study_handler)]):
+    return render_study_step(request, user, await handler.current(session_id, user.id))
+
+@app.get("/study/session/{session_id}/{position}/{outcome}")
+async def answer_card(request: Request, session_id: int, position: int, outcome: Literal["skip", "forgot", "hard", "studied", "easy"],
+                      user: Annotated[User, Depends(get_current_user)], handler: Annotated[AsyncStudyHandler, Depends(get_study_handler)]):
+    # The answer is recorded and the next card rendered in the same response
+    step = await handler.answer(session_id, user.id, position, GRADES.get(outcome))
+    return render_study_step(request, user, step)
+
+def encode_deck(deck: dict, compress: bool) -> bytes:
+    content = json.dumps(deck, separators=(",", ":")).encode()
+    return gzip.compress(content, compresslevel=6) if compress else content
+
+def deck_etag(kind: str, deck_id: int, version: int, modified: float) -> str:
+    # Weak because the payload may be served gzipped or not
+    return f'W/"{kind}-{deck_id}-{version}-{int(modified)}"'
+
+# Whole deck for offline study, revalidated with If-None-Match
+@app.get("/study/offline/{kind}/{deck_id}")
+async def offline_deck(request: Request, kind: Literal["set", "super_set"], deck_id: int,
+                       user: Annotated[User, Depends(get_current_user)], handler: Annotated[AsyncSetHandler, Depends(get_set_handler)]):
+    headers = {"Cache-Control": "private, no-cache", "Vary": "Accept-Encoding"}
+    # Cheap version lookup first, an unchanged deck is answered without reading its cards
+    version = await handler.get_deck_version(user.id, kind, deck_id)
+    if version is None:
+        raise HTTPException(status_code=404, detail="Deck not found")
+    etag = deck_etag(kind, deck_id, *version)
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers={**headers, "ETag": etag})
+    deck = await handler.get_deck(user.id, kind, deck_id)
+    if deck is None:
+        raise HTTPException(status_code=404, detail="Deck not found")
+    headers["ETag"] = deck_etag(kind, deck_id, deck["version"], deck["modified"])
+    headers["Last-Modified"] = formatdate(deck["modified"], usegmt=True)
+    compress = "gzip" in request.headers.get("accept-encoding", "")
+    # Encoding and compressing a large deck takes a while, keep it off the event loop
+    content = await run_in_pool(encode_deck, deck, compress)
+    if compress:
+        headers["Content-Encoding"] = "gzip"
+    return Response(content, media_type="application/json", headers=headers)
+
+# Reviews made offline, synced in batches
+@app.post("/study/reviews")
+async def sync_reviews(reviews: list[Review], user: Annotated[User, Depends(get_current_user)], handler: Annotated[AsyncStudyHandler, Depends(get_study_handler)]):
+    if len(reviews) > MAX_REVIEW_BATCH:
+        raise HTTPException(status_code=413, detail=f"At most {MAX_REVIEW_BATCH} reviews per batch")
+    applied = await handler.apply_reviews(user.id, reviews)
+    if applied is None:
+        raise HTTPException(status_code=404, detail="Card not found")
+    return {"received": len(reviews), "applied": applied}
+
+@app.get("/study/reset/{set_id}")
+async def reset_study_progress(set_id: int, user: Annotated[User, Depends(get_current_user)], handler: Annotated[AsyncStudyHandler, Depends(get_study_handler)]):
+    await handler.reset_progress(user.id, set_id)
+    return RedirectResponse(url="/sets")
 
 ### Run the server ###
 if __name__ == "__main__":
@@ -0,0 +1,111 @@
+"""p50/p99 latency of a set page under concurrent requests, sync routes against async routes.
+
+Run from the repository root (needs httpx):
+    python -m benchmarks.bench_async --requests 2000 --concurrency 16 64 256
+
+"sync" is a plain def route calling SetHandler on Starlette's request threadpool, which is
+how every route used to run. "async" is an async def route awaiting AsyncSetHandler, whose
+reads run on the FLASHLEARN_DB_WORKERS database pool and writes on the writer thread while
+the event loop keeps serving. With --write-share every so many requests add a card instead
+of reading the set, latencies are reported for reads and writes separately.
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import tempfile
+import time
+
+import httpx
+from fastapi import FastAPI
+
+from flashlearn.utils.database import DB_WORKERS, DatabaseManager
+from flashlearn.utils.set_handler import AsyncSetHandler, SetHandler
+
+
+def build_app() -> FastAPI:
+    app = FastAPI()
+    handler = SetHandler()
+    async_handler = AsyncSetHandler()
+
+    @app.get("/sync/{set_id}")
+    def sync_set(set_id: int):
+        return len(handler.get_set(set_id, 1, 0).cards)
+
+    @app.get("/async/{set_id}")
+    async def async_set(set_id: int):
+        return len((await async_handler.get_set(set_id, 1, 0)).cards)
+
+    @app.post("/sync/{set_id}")
+    def sync_add(set_id: int):
+        return handler.add_card_to_set(set_id, 1, "Term", "Body").id
+
+    @app.post("/async/{set_id}")
+    async def async_add(set_id: int):
+        return (await async_handler.add_card_to_set(set_id, 1, "Term", "Body")).id
+
+    return app
+
+
+def percentiles(latencies: list[float]) -> tuple[float, float]:
+    if len(latencies) < 2:
+        return float("nan"), float("nan")
+    quantiles = statistics.quantiles(latencies, n=100)
+    return quantiles[49] * 1000, quantiles[98] * 1000
+
+
+async def measure(client: httpx.AsyncClient, read_url: str, write_url: str, requests: int, concurrency: int,
+                  write_share: float) -> tuple[tuple[float, float], tuple[float, float], float]:
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = {"GET": [], "POST": []}
+    every = round(1 / write_share) if write_share else 0
+
+    async def request(number: int):
+        method = "POST" if every and number % every == 0 else "GET"
+        async with semaphore:
+            start = time.perf_counter()
+            response = await client.request(method, write_url if method == "POST" else read_url)
+            latencies[method].append(time.perf_counter() - start)
+            assert response.status_code == 200
+
+    start = time.perf_counter()
+    await asyncio.gather(*(request(number) for number in range(requests)))
+    elapsed = time.perf_counter() - start
+    return percentiles(latencies["GET"]), percentiles(latencies["POST"]), requests / elapsed
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[16, 64, 256])
+    parser.add_argument("--cards", type=int, default=50)
+    parser.add_argument("--write-share", type=float, nargs="+", default=[0.0, 0.1])
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        DatabaseManager.path = os.path.join(tmp, "bench.db")
+        handler = SetHandler()
+        handler._db.insert_into_table("USER", email="bench@example.com", password="", name="bench")
+        set_id = handler.create_set("Deck", 1).id
+        # Writes go to another set, so the set being read keeps its size across runs
+        inbox_id = handler.create_set("Inbox", 1).id
+        rows = ((f"Term {i}", "Body " * 50, 1, set_id) for i in range(args.cards))
+        list(handler._db.insert_many("FLASHCARD", ("term", "body", "user_id", "set_id"), [list(rows)]))
+
+        transport = httpx.ASGITransport(app=build_app())
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            print(f"db workers: {DB_WORKERS}")
+            print(f"{'route':>5} {'writes':>6} {'concurrency':>11} {'read p50':>8} {'read p99':>8} "
+                  f"{'write p50':>9} {'write p99':>9} {'req/s':>8}")
+            for write_share in args.write_share:
+                for concurrency in args.concurrency:
+                    for route in ("sync", "async"):
+                        (read_p50, read_p99), (write_p50, write_p99), throughput = await measure(
+                            client, f"/{route}/{set_id}", f"/{route}/{inbox_id}", args.requests, concurrency, write_share)
+                        print(f"{route:>5} {write_share:>6.0%} {concurrency:>11} {read_p50:>8.2f} {read_p99:>8.2f} "
+                              f"{write_p50:>9.2f} {write_p99:>9.2f} {throughput:>8.1f}")
+        DatabaseManager().close_connection()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
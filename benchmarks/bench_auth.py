@@ -0,0 +1,50 @@
+"""Per-request authentication latency.
+
+Run from the repository root:
+    python -m benchmarks.bench_auth --calls 20000
+
+"database" is the old email cookie looked up with UserHandler.get_user on every
+request, "signed" verifies an HMAC session token in memory like get_current_user
+(repeat requests hit the verified-token cache).
+"""
+import argparse
+import os
+import tempfile
+import time
+
+from flashlearn.security.token import create_token, verify_token
+from flashlearn.utils.database import DatabaseManager
+from flashlearn.utils.user_handler import UserHandler
+
+
+def per_call(function, calls: int) -> float:
+    start = time.perf_counter()
+    for _ in range(calls):
+        function()
+    return (time.perf_counter() - start) / calls * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--calls", type=int, default=20000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        DatabaseManager.path = os.path.join(tmp, "bench.db")
+        handler = UserHandler()
+        handler._db.insert_into_table("USER", email="bench@example.com", password="", name="bench")
+        user = handler.get_user("bench@example.com")
+        token = create_token(user)
+        results = [
+            ("database", per_call(lambda: handler.get_user(user.email), args.calls)),
+            ("signed", per_call(lambda: verify_token(token), args.calls)),
+        ]
+        DatabaseManager().close_connection()
+
+    print(f"{'auth':>9} {'us/request':>11}")
+    for name, latency in results:
+        print(f"{name:>9} {latency:>11.2f}")
+
+
+if __name__ == "__main__":
+    main()
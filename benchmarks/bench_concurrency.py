@@ -0,0 +1,81 @@
+"""Read throughput of SetHandler.get_set for 1 to N worker threads.
+
+Run from the repository root:
+    python -m benchmarks.bench_concurrency --threads 8
+
+The "serialized" column wraps every call in one global lock, which is how the
+old single-connection DatabaseManager behaved, the "pooled" column uses the
+per-thread WAL connections directly.
+"""
+import argparse
+import contextlib
+import os
+import random
+import tempfile
+import threading
+import time
+from typing import Optional
+
+from flashlearn.utils.database import DatabaseManager
+from flashlearn.utils.set_handler import SetHandler
+
+
+def populate(handler: SetHandler, sets: int, cards: int) -> list[int]:
+    set_ids = []
+    for i in range(sets):
+        new_set = handler.create_set(f"Set {i}", 1)
+        for j in range(cards):
+            handler.add_card_to_set(new_set.id, 1, f"Term {i}.{j}", f"Body {i}.{j}")
+        set_ids.append(new_set.id)
+    return set_ids
+
+
+def run(handler: SetHandler, set_ids: list[int], threads: int, seconds: float, lock: Optional[threading.Lock]) -> float:
+    done = [0] * threads
+    deadline = time.perf_counter() + seconds
+
+    def worker(index: int):
+        while time.perf_counter() < deadline:
+            set_id = random.choice(set_ids)
+            if lock is None:
+                handler.get_set(set_id, 1)
+            else:
+                with lock:
+                    handler.get_set(set_id, 1)
+            done[index] += 1
+
+    workers = [threading.Thread(target=worker, args=(i,)) for i in range(threads)]
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    return sum(done) / seconds
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--sets", type=int, default=50)
+    parser.add_argument("--cards", type=int, default=50)
+    parser.add_argument("--seconds", type=float, default=2.0)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp, open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        DatabaseManager.path = os.path.join(tmp, "bench.db")
+        handler = SetHandler()
+        handler._db.insert_into_table("USER", email="bench@example.com", password="", name="bench")
+        set_ids = populate(handler, args.sets, args.cards)
+        rows = []
+        for threads in range(1, args.threads + 1):
+            serialized = run(handler, set_ids, threads, args.seconds, threading.Lock())
+            pooled = run(handler, set_ids, threads, args.seconds, None)
+            rows.append((threads, serialized, pooled))
+        DatabaseManager().close_connection()
+
+    print(f"{'threads':>7} {'serialized req/s':>17} {'pooled req/s':>13}")
+    for threads, serialized, pooled in rows:
+        print(f"{threads:>7} {serialized:>17.0f} {pooled:>13.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,46 @@
+"""Bulk card creation throughput through SetHandler.add_card_to_set.
+
+Run from the repository root:
+    python -m benchmarks.bench_inserts --cards 2000
+
+The "reselect" column repeats the old content-matching SELECT after every
+insert, the "lastrowid" column is the current single-statement path.
+"""
+import argparse
+import contextlib
+import os
+import tempfile
+import time
+
+from flashlearn.utils.database import DatabaseManager
+from flashlearn.utils.set_handler import SetHandler
+
+
+def create_cards(handler: SetHandler, set_id: int, cards: int, reselect: bool) -> float:
+    start = time.perf_counter()
+    for i in range(cards):
+        card = handler.add_card_to_set(set_id, 1, f"Term {i}", f"Body {i}")
+        if reselect:
+            handler._db.select_from_table("FLASHCARD", term=card.term, body=card.body, user_id=1, set_id=set_id)
+    return cards / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--cards", type=int, default=2000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp, open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        DatabaseManager.path = os.path.join(tmp, "bench.db")
+        handler = SetHandler()
+        handler._db.insert_into_table("USER", email="bench@example.com", password="", name="bench")
+        reselect = create_cards(handler, handler.create_set("Reselect", 1).id, args.cards, True)
+        lastrowid = create_cards(handler, handler.create_set("Lastrowid", 1).id, args.cards, False)
+        DatabaseManager().close_connection()
+
+    print(f"{'cards':>7} {'reselect cards/s':>17} {'lastrowid cards/s':>18}")
+    print(f"{args.cards:>7} {reselect:>17.0f} {lastrowid:>18.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+"""Login throughput under concurrent load, and how long the event loop stalls meanwhile.
+
+Run from the repository root:
+    python -m benchmarks.bench_login --logins 64 --concurrency 1 4 16
+
+Hashing runs on the dedicated pool from flashlearn.security.hash (FLASHLEARN_HASH_WORKERS
+threads), so the loop lag column should stay near zero at any concurrency.
+"""
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+
+from flashlearn.security.hash import HASH_WORKERS
+from flashlearn.utils.database import DatabaseManager
+from flashlearn.utils.user_handler import UserHandler
+
+
+async def measure(handler: UserHandler, logins: int, concurrency: int) -> tuple[float, float]:
+    semaphore = asyncio.Semaphore(concurrency)
+    lag = 0.0
+    running = True
+
+    async def ticker():
+        nonlocal lag
+        while running:
+            start = time.perf_counter()
+            await asyncio.sleep(0.001)
+            lag = max(lag, time.perf_counter() - start - 0.001)
+
+    async def login():
+        async with semaphore:
+            assert await handler.login("bench@example.com", "password") is not None
+
+    tick = asyncio.create_task(ticker())
+    start = time.perf_counter()
+    await asyncio.gather(*(login() for _ in range(logins)))
+    elapsed = time.perf_counter() - start
+    running = False
+    await tick
+    return logins / elapsed, lag * 1000
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--logins", type=int, default=64)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 16])
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        DatabaseManager.path = os.path.join(tmp, "bench.db")
+        handler = UserHandler()
+        await handler.register("bench", "password", "bench@example.com")
+        print(f"hash workers: {HASH_WORKERS}")
+        print(f"{'concurrency':>11} {'logins/s':>9} {'max loop lag ms':>16}")
+        for concurrency in args.concurrency:
+            throughput, lag = await measure(handler, args.logins, concurrency)
+            print(f"{concurrency:>11} {throughput:>9.1f} {lag:>16.2f}")
+        DatabaseManager().close_connection()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,59 @@
+"""Per-query overhead of SetHandler.get_card and UserHandler.get_user.
+
+Run from the repository root:
+    python -m benchmarks.bench_queries --calls 20000
+
+The "dynamic" column rebuilds the SELECT with f-strings on every call like the
+old select_from_table did, the "prepared" column uses the cached statement text.
+"""
+import argparse
+import contextlib
+import os
+import tempfile
+import time
+
+from flashlearn.utils.database import DatabaseManager
+from flashlearn.utils.set_handler import SetHandler
+from flashlearn.utils.user_handler import UserHandler
+
+
+def dynamic_select(db: DatabaseManager, table_name: str, **kwargs) -> list[tuple]:
+    query = f"SELECT * FROM {table_name}"
+    conditions = ' AND '.join(f"{key} IS ?" for key in kwargs.keys())
+    query += f" WHERE {conditions}"
+    return db.execute_query(query, list(kwargs.values()))
+
+
+def per_call(function, calls: int) -> float:
+    start = time.perf_counter()
+    for _ in range(calls):
+        function()
+    return (time.perf_counter() - start) / calls * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--calls", type=int, default=20000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp, open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        DatabaseManager.path = os.path.join(tmp, "bench.db")
+        sets, users = SetHandler(), UserHandler()
+        db = sets._db
+        db.insert_into_table("USER", email="bench@example.com", password="", name="bench")
+        card = sets.add_card_to_set(sets.create_set("Bench", 1).id, 1, "term", "body")
+        results = [
+            ("get_card", per_call(lambda: dynamic_select(db, "FLASHCARD", id=card.id), args.calls),
+             per_call(lambda: sets.get_card(card.id), args.calls)),
+            ("get_user", per_call(lambda: dynamic_select(db, "USER", email="bench@example.com"), args.calls),
+             per_call(lambda: users.get_user("bench@example.com"), args.calls)),
+        ]
+        db.close_connection()
+
+    print(f"{'query':>9} {'dynamic us/call':>16} {'prepared us/call':>17}")
+    for name, dynamic, prepared in results:
+        print(f"{name:>9} {dynamic:>16.2f} {prepared:>17.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,4 @@
+import logging
+
+# Library modules stay silent until flashlearn.utils.log.configure_logging is called
+logging.getLogger(__name__).addHandler(logging.NullHandler())
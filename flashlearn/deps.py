@@ -1,24 +1,67 @@
 from fastapi import HTTPException, Depends, Request
 from flashlearn.security.cookie import OAuth2WithCookie
+from flashlearn.security.token import create_token, keyring, token_needs_reload, verify_token, TOKEN_TTL
 from flashlearn.models.user import User
 from flashlearn.utils.user_handler import UserHandler
-from flashlearn.utils.set_handler import SetHandler
+from flashlearn.utils.set_handler import AsyncSetHandler
+from flashlearn.utils.study_handler import AsyncStudyHandler
+from flashlearn.utils.database import run_in_pool
 
-from typing import Annotated
+from fastapi.security.utils import get_authorization_scheme_param
+from typing import Annotated, Optional
 
 oauth2_scheme = OAuth2WithCookie(tokenUrl="/token")
 
 # Dependency injections used for authentication, authorization, and database access
 
-def get_current_user(email: Annotated[str, Depends(oauth2_scheme)]) -> User:
-    handler = UserHandler()
-    user = handler.get_user(email)
+async def create_token_async(user: User) -> str:
+    # A due key rotation writes to SQLite, so it runs on the database pool instead of the event loop
+    if keyring.needs_reload():
+        return await run_in_pool(create_token, user)
+    return create_token(user)
+
+async def verify_token_async(token: str, max_age: Optional[float] = TOKEN_TTL) -> Optional[User]:
+    # Signed tokens are verified in memory on the event loop. Only a key reload reads
+    # SQLite, and it can wait for the write lock, so it runs on the database pool.
+    if token_needs_reload(token):
+        return await run_in_pool(verify_token, token, max_age)
+    return verify_token(token, max_age)
+
+async def renew_session(request: Request, user: User) -> Optional[User]:
+    # A token older than TOKEN_TTL is only renewed while its epoch is still the user's,
+    # the new token is stored in the cookie by api.renew_session_cookie
+    fresh = await run_in_pool(UserHandler().get_user, user.email)
+    if fresh is None or fresh.epoch != user.epoch:
+        return None
+    request.state.session_token = await create_token_async(fresh)
+    return fresh
+
+async def get_current_user(request: Request, token: Annotated[str, Depends(oauth2_scheme)]) -> User:
+    user = await verify_token_async(token)
     if user is None:
-        raise HTTPException(status_code=401, detail="Invalid username or password", headers={"WWW-Authenticate": "Bearer"})
+        stale = await verify_token_async(token, max_age=None)
+        if stale is not None:
+            user = await renew_session(request, stale)
+    if user is None:
+        # Drop the bad cookie so /login does not bounce back to /home
+        raise HTTPException(status_code=302, detail="Invalid or expired session",
+                            headers={"Location": "/login", "Set-Cookie": "access_token=; Max-Age=0; Path=/"})
     return user
 
-def ensure_not_logged_in(request: Request):
-    if request.cookies.get("access_token"):
+async def get_fresh_user(user: Annotated[User, Depends(get_current_user)]) -> User:
+    # Re-reads the user behind a valid token from the database, used when the token is
+    # explicitly refreshed, so a refresh never outlives a password change
+    handler = UserHandler()
+    fresh = await run_in_pool(handler.get_user, user.email)
+    # A password change since the token was issued ends the session
+    if fresh is None or fresh.epoch != user.epoch:
+        raise HTTPException(status_code=401, detail="Invalid username or password", headers={"WWW-Authenticate": "Bearer"})
+    return fresh
+
+async def ensure_not_logged_in(request: Request):
+    scheme, token = get_authorization_scheme_param(request.cookies.get("access_token"))
+    # Stale tokens count too, /home renews them or sends the user back to /login
+    if scheme.lower() == "bearer" and await verify_token_async(token, max_age=None) is not None:
         return True
     return False
 
@@ -26,4 +69,7 @@ def get_user_handler():
     return UserHandler()
 
 def get_set_handler():
-    return SetHandler()
\ No newline at end of file
+    return AsyncSetHandler()
+
+def get_study_handler():
+    return AsyncStudyHandler()
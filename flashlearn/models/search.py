@@ -0,0 +1,18 @@
+from dataclasses import dataclass
+
+from flashlearn.models.card import Card
+
+# Control characters wrapped around matched words in SearchResult texts. They do not occur
+# in typed text, so templates can escape the text first and then turn them into markup.
+MATCH_START = "\x02"
+MATCH_END = "\x03"
+
+@dataclass
+class SearchResult:
+    """Class representing a card found by a full-text search"""
+    card: Card
+    """Matching card"""
+    term: str
+    """Term of card with matches wrapped in MATCH_START and MATCH_END"""
+    body: str
+    """Snippet of the card's body around its matches, marked like term"""
@@ -9,11 +9,21 @@ class AbstractSet:
         self.kind = kind
 
 class Set(AbstractSet):
-    def __init__(self, id: int, title: str, cards: list[Card]):
+    def __init__(self, id: int, title: str, cards: list[Card], next_cursor: Optional[int] = None):
         super().__init__(id, title, "set")
         self.cards = cards
+        # Id of the last card shown when more cards follow, see SetHandler.get_set
+        self.next_cursor = next_cursor
 
 class SuperSet(AbstractSet):
-    def __init__(self, id: int, title: str, sets: list[Set]):
+    def __init__(self, id: int, title: str, sets: list[AbstractSet], next_cursor: Optional[int] = None):
         super().__init__(id, title, "super_set")
-        self.sets = sets
\ No newline at end of file
+        self.sets = sets
+        # Id of the last set shown when more sets follow, see SetHandler.get_super_set
+        self.next_cursor = next_cursor
+
+class SetSummary(AbstractSet):
+    def __init__(self, id: int, title: str, kind: str, card_count: int, studied_count: int):
+        super().__init__(id, title, kind)
+        self.card_count = card_count
+        self.studied_count = studied_count
\ No newline at end of file
@@ -0,0 +1,28 @@
+from dataclasses import dataclass
+from typing import Annotated, Literal
+
+from pydantic import Field
+
+from flashlearn.models.card import Card
+
+@dataclass
+class StudyStep:
+    """Class representing the current card of a study session"""
+    session_id: int
+    """ID of study session in database"""
+    position: int
+    """Position of card in the session's shuffled queue"""
+    size: int
+    """Number of cards queued in the session"""
+    card: Card
+    """Card to study"""
+
+@dataclass
+class Review:
+    """Class representing one review of a card made by a client, e.g. while offline"""
+    card_id: int
+    """ID of reviewed card"""
+    outcome: Literal["forgot", "hard", "studied", "easy"]
+    """Answer given, see flashlearn.utils.scheduler.GRADES"""
+    timestamp: Annotated[float, Field(allow_inf_nan=False)]
+    """Unix timestamp of the review, NaN and infinities are rejected with a 422"""
@@ -8,4 +8,6 @@ class User:
     email: str
     """Email of user"""
     name: str
-    """Name of user"""
\ No newline at end of file
+    """Name of user"""
+    epoch: int = 0
+    """Session epoch of user, bumped when the password changes"""
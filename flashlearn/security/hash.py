@@ -1,7 +1,45 @@
+import asyncio
 import hashlib
+import hmac
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+# scrypt cost for new hashes. Each hash stores its own parameters, so raising these
+# only affects new passwords and logins of users whose hash is older (see needs_rehash).
+SCRYPT_N = int(os.environ.get("FLASHLEARN_SCRYPT_N", 2 ** 14))
+SCRYPT_R = int(os.environ.get("FLASHLEARN_SCRYPT_R", 8))
+SCRYPT_P = int(os.environ.get("FLASHLEARN_SCRYPT_P", 1))
+SALT_BYTES = 16
+# Hashing runs on its own bounded pool so login bursts queue here instead of
+# occupying the request threadpool. hashlib.scrypt releases the GIL while it works.
+HASH_WORKERS = int(os.environ.get("FLASHLEARN_HASH_WORKERS", os.cpu_count() or 2))
+
+_pool = ThreadPoolExecutor(max_workers=HASH_WORKERS, thread_name_prefix="flashlearn-hash")
+
+def _scrypt(password: str, salt: bytes, n: int, r: int, p: int) -> bytes:
+    return hashlib.scrypt(password.encode(), salt=salt, n=n, r=r, p=p, maxmem=256 * n * r * p + 1024 * 1024, dklen=32)
 
 def get_hash(password: str) -> str:
-    return hashlib.sha256(password.encode()).hexdigest()
+    '''Returns "scrypt$n$r$p$salt$digest" for a new random salt'''
+    salt = os.urandom(SALT_BYTES)
+    digest = _scrypt(password, salt, SCRYPT_N, SCRYPT_R, SCRYPT_P)
+    return f"scrypt${SCRYPT_N}${SCRYPT_R}${SCRYPT_P}${salt.hex()}${digest.hex()}"
 
 def check_hash(password: str, hash: str) -> bool:
-    return get_hash(password) == hash
\ No newline at end of file
+    if not hash:
+        return False
+    if not hash.startswith("scrypt$"):
+        # Legacy unsalted SHA-256 hex digest
+        return hmac.compare_digest(hashlib.sha256(password.encode()).hexdigest(), hash)
+    _, n, r, p, salt, digest = hash.split("$")
+    return hmac.compare_digest(_scrypt(password, bytes.fromhex(salt), int(n), int(r), int(p)).hex(), digest)
+
+def needs_rehash(hash: str) -> bool:
+    '''True for legacy hashes and hashes made with other cost parameters than the current ones'''
+    return not hash.startswith(f"scrypt${SCRYPT_N}${SCRYPT_R}${SCRYPT_P}$")
+
+async def get_hash_async(password: str) -> str:
+    return await asyncio.wrap_future(_pool.submit(get_hash, password))
+
+async def check_hash_async(password: str, hash: str) -> bool:
+    return await asyncio.wrap_future(_pool.submit(check_hash, password, hash))
@@ -0,0 +1,127 @@
+import base64
+import hmac
+import json
+import os
+import threading
+import time
+from typing import Callable, Optional
+
+from flashlearn.models.user import User
+from flashlearn.utils.cache import TTLCache
+
+# How long a session can be renewed without logging in again, and its cookie kept
+SESSION_TTL = 7 * 24 * 3600
+# How long a token is trusted on its signature alone. Older tokens are only renewed while
+# the user's session epoch is unchanged, so a password change ends other sessions this soon
+TOKEN_TTL = int(os.environ.get("FLASHLEARN_TOKEN_TTL", 15 * 60))
+# How long a key signs new tokens before a fresh one replaces it
+KEY_ROTATION_AGE = 30 * 24 * 3600
+# Minimum seconds between reloads triggered by unknown key ids
+RELOAD_INTERVAL = 5
+
+def _encode(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode()
+
+def _decode(data: str) -> bytes:
+    return base64.urlsafe_b64decode(data + "=" * (-len(data) % 4))
+
+class KeyRing:
+    '''
+    HMAC keys by id. The newest key signs new tokens, every loaded key can verify.
+
+    Keys come from loader, which returns {key_id: (secret, created)} and is expected to
+    create a fresh key when the newest one is older than KEY_ROTATION_AGE. The ring asks
+    the loader again once its signing key ages out, and when a token names a key it has
+    not seen yet, e.g. one created by another worker.
+    '''
+    def __init__(self, loader: Optional[Callable[[], dict[int, tuple[bytes, float]]]] = None):
+        self.loader = loader
+        self._keys = {}
+        self._active = None
+        self._loaded_at = 0.0
+        self._lock = threading.Lock()
+
+    def reload(self):
+        keys = self.loader()
+        with self._lock:
+            self._keys = keys
+            self._active = max(keys, key=lambda key_id: keys[key_id][1])
+            self._loaded_at = time.monotonic()
+
+    def needs_reload(self, key_id: Optional[int] = None) -> bool:
+        '''True if signing, or verifying a token signed with key_id, first calls the loader'''
+        if key_id is None:
+            return self._active is None or self._keys[self._active][1] < time.time() - KEY_ROTATION_AGE
+        # Throttled, so tokens with made-up key ids cannot force a reload per request
+        return key_id not in self._keys and self._loaded_at < time.monotonic() - RELOAD_INTERVAL
+
+    def _signing_key(self) -> tuple[int, bytes]:
+        if self.needs_reload():
+            self.reload()
+        with self._lock:
+            return self._active, self._keys[self._active][0]
+
+    def _verifying_key(self, key_id: int) -> Optional[bytes]:
+        if self.needs_reload(key_id):
+            self.reload()
+        entry = self._keys.get(key_id)
+        return entry[0] if entry else None
+
+    def sign(self, payload: dict) -> str:
+        key_id, secret = self._signing_key()
+        body = f"{key_id}.{_encode(json.dumps(payload, separators=(',', ':')).encode())}"
+        signature = hmac.digest(secret, body.encode(), "sha256")
+        return f"{body}.{_encode(signature)}"
+
+    def verify(self, token: str) -> Optional[dict]:
+        try:
+            key_id, payload, signature = token.split(".")
+            secret = self._verifying_key(int(key_id))
+            if secret is None:
+                return None
+            expected = hmac.digest(secret, f"{key_id}.{payload}".encode(), "sha256")
+            if not hmac.compare_digest(expected, _decode(signature)):
+                return None
+            return json.loads(_decode(payload))
+        except (ValueError, TypeError):
+            return None
+
+# Process-wide key ring, its loader is installed by flashlearn.utils.user_handler
+keyring = KeyRing()
+
+# Recently verified tokens, so repeat requests skip the signature check and JSON decoding
+verified_tokens = TTLCache(maxsize=4096, ttl=300, name="tokens")
+
+def create_token(user: User, ttl: int = SESSION_TTL) -> str:
+    now = int(time.time())
+    return keyring.sign({"id": user.id, "email": user.email, "name": user.name, "epoch": user.epoch, "iat": now, "exp": now + ttl})
+
+def token_needs_reload(token: Optional[str]) -> bool:
+    '''True if verify_token would load keys for this token, which reads the database'''
+    try:
+        return bool(token) and keyring.needs_reload(int(token.split(".", 1)[0]))
+    except ValueError:
+        return False
+
+def verify_token(token: Optional[str], max_age: Optional[float] = TOKEN_TTL) -> Optional[User]:
+    '''
+    Returns the user a token was issued to, or None if it is forged, malformed, expired or
+    issued more than max_age seconds ago. With max_age None any unexpired token is returned,
+    the caller then has to check the user's session epoch before trusting it.
+    '''
+    if not token:
+        return None
+    entry = verified_tokens.get(token)
+    if entry is None:
+        claims = keyring.verify(token)
+        if claims is None:
+            return None
+        # Tokens issued before session epochs have neither claim, they are renewed like stale ones
+        user = User(claims["id"], claims["email"], claims["name"], claims.get("epoch", 0))
+        entry = (user, claims.get("iat", 0), claims.get("exp", 0))
+        verified_tokens.set(token, entry)
+    user, issued, expires = entry
+    now = time.time()
+    if expires < now or (max_age is not None and issued < now - max_age):
+        return None
+    return user
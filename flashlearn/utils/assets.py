@@ -0,0 +1,99 @@
+import gzip
+import hashlib
+import logging
+import mimetypes
+import os
+from dataclasses import dataclass
+from typing import Optional
+
+from fastapi.responses import Response
+from fastapi.staticfiles import StaticFiles
+from jinja2 import pass_context
+from starlette.datastructures import Headers
+from starlette.types import Scope
+
+try:
+    import brotli
+except ImportError:  # Optional, assets are only precompressed with gzip without it
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+# Fingerprinted URLs change with their content, so browsers may keep them forever
+IMMUTABLE = "public, max-age=31536000, immutable"
+# A compressed variant is only kept when it saves at least this share of the original size
+MIN_SAVING = 0.1
+
+@dataclass
+class Asset:
+    '''An asset file loaded into memory with its precompressed variants'''
+    content: bytes
+    media_type: str
+    etag: str
+    encodings: dict[str, bytes]  # content encoding -> compressed content
+
+    def response(self, headers: Headers, cache_control: str = IMMUTABLE) -> Response:
+        response_headers = {"Cache-Control": cache_control, "ETag": self.etag, "Vary": "Accept-Encoding"}
+        if headers.get("if-none-match") == self.etag:
+            return Response(status_code=304, headers=response_headers)
+        # Brotli is preferred over gzip when the browser accepts both
+        accepted = headers.get("accept-encoding", "")
+        for encoding in ("br", "gzip"):
+            if encoding in self.encodings and encoding in accepted:
+                response_headers["Content-Encoding"] = encoding
+                return Response(self.encodings[encoding], media_type=self.media_type, headers=response_headers)
+        return Response(self.content, media_type=self.media_type, headers=response_headers)
+
+def fingerprint(path: str, content: bytes) -> str:
+    '''Returns path with a hash of content before its extension, "base.css" becomes "base.1a2b3c4d5e6f.css"'''
+    root, extension = os.path.splitext(path)
+    return f"{root}.{hashlib.sha256(content).hexdigest()[:12]}{extension}"
+
+def compress(content: bytes) -> dict[str, bytes]:
+    encodings = {"gzip": gzip.compress(content, compresslevel=9, mtime=0)}
+    if brotli is not None:
+        encodings["br"] = brotli.compress(content, quality=11)
+    return {encoding: data for encoding, data in encodings.items() if len(data) <= len(content) * (1 - MIN_SAVING)}
+
+class FingerprintedStaticFiles(StaticFiles):
+    '''
+    StaticFiles that fingerprints and precompresses every asset once at startup.
+
+    Sample usage:
+      ```app.mount("/assets", FingerprintedStaticFiles(directory="interface/assets"), name="assets")```
+      ```templates.env.globals["asset_url"] = assets.asset_url```
+    then ```{{ asset_url('base.css') }}``` in a template links "/assets/base.1a2b3c4d5e6f.css",
+    which is served from memory with an immutable Cache-Control. Unhashed names are still
+    served from disk like before. Assets changed while the server runs keep their old
+    fingerprint until it restarts.
+    '''
+    def __init__(self, directory: str, **kwargs):
+        super().__init__(directory=directory, **kwargs)
+        self.urls = {}  # asset path -> fingerprinted path
+        self.assets = {}  # fingerprinted path -> Asset
+        for root, _, files in os.walk(directory):
+            for name in files:
+                full_path = os.path.join(root, name)
+                path = os.path.relpath(full_path, directory).replace(os.sep, "/")
+                with open(full_path, "rb") as file:
+                    content = file.read()
+                self.urls[path] = fingerprint(path, content)
+                media_type = mimetypes.guess_type(name)[0] or "application/octet-stream"
+                self.assets[self.urls[path]] = Asset(content, media_type, f'"{self.urls[path]}"', compress(content))
+        logger.info("Fingerprinted %s assets in %s", len(self.assets), directory)
+
+    def get(self, path: str) -> Optional[Asset]:
+        '''Returns the asset at its unhashed path, None if there is no such asset'''
+        return self.assets.get(self.urls.get(path))
+
+    async def get_response(self, path: str, scope: Scope) -> Response:
+        asset = self.assets.get(path.replace(os.sep, "/"))
+        if asset is None:
+            return await super().get_response(path, scope)
+        return asset.response(Headers(scope=scope))
+
+    @pass_context
+    def asset_url(self, context: dict, path: str) -> str:
+        '''Jinja global replacing url_for('assets', path=...) with the fingerprinted URL of the asset'''
+        return str(context["request"].url_for("assets", path=self.urls.get(path, path)))
+
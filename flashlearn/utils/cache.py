@@ -0,0 +1,79 @@
+import asyncio
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Hashable
+
+logger = logging.getLogger(__name__)
+
+# Seconds between two reports of the hit and miss counters of every named cache
+STATS_INTERVAL = float(os.environ.get("FLASHLEARN_CACHE_STATS_INTERVAL", 60))
+
+# Caches by name, reported by report_stats
+CACHES = {}
+
+class TTLCache:
+    '''
+    Thread-safe LRU cache whose entries also expire ttl seconds after they were set.
+
+    Sample usage:
+      ```cache = TTLCache(maxsize=1024, ttl=300, name="pages")```
+      ```cache.set("key", value); cache.get("key")```
+    A named cache has its counters reported by report_stats.
+    '''
+    def __init__(self, maxsize: int = 1024, ttl: float = 300.0, name: str = ""):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()  # key -> (expires_at, value), least recently used first
+        self._lock = threading.Lock()
+        if name:
+            CACHES[name] = self
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return default
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key: Hashable, value: Any):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, key: Hashable):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "maxsize": self.maxsize,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+            }
+
+async def report_stats(interval: float = STATS_INTERVAL):
+    '''Logs the counters of every named cache at DEBUG level every interval seconds, until cancelled'''
+    while True:
+        await asyncio.sleep(interval)
+        for name, cache in CACHES.items():
+            logger.debug("%s cache: %s", name, cache.stats())
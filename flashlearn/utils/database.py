@@ -1,117 +1,260 @@
+import asyncio
+import logging
+import os
 import sqlite3
 import threading
-from typing import Optional
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Any, Callable, Iterable, Iterator, Optional
 
-from typing import Optional
+from flashlearn.utils.migrations import MIGRATIONS
+from flashlearn.utils.tables import get_table
+
+logger = logging.getLogger(__name__)
+
+# Pragmas applied to every pooled connection. WAL lets readers run alongside the
+# single writer, and busy_timeout makes writers from other workers wait instead of failing.
+PRAGMAS = {
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",
+    "busy_timeout": 5000,
+    "mmap_size": 268435456,
+    "cache_size": -16000,
+    "temp_store": "MEMORY",
+    "foreign_keys": "ON",
+}
+
+# Async callers run their database reads on this pool instead of the event loop. Each worker
+# keeps its own connection, so reads run in parallel under WAL.
+DB_WORKERS = int(os.environ.get("FLASHLEARN_DB_WORKERS", 4))
+
+_pool = ThreadPoolExecutor(max_workers=DB_WORKERS, thread_name_prefix="flashlearn-db")
+# SQLite has a single writer, so writes queue on one thread of their own instead of
+# holding pool workers while they wait for DatabaseManager.lock
+_writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="flashlearn-db-writer")
+
+async def run_in_pool(function: Callable, *args, **kwargs) -> Any:
+    '''Awaits function(*args, **kwargs) called on a database worker'''
+    return await asyncio.wrap_future(_pool.submit(function, *args, **kwargs))
+
+async def run_in_writer(function: Callable, *args, **kwargs) -> Any:
+    '''Awaits function(*args, **kwargs) called on the database writer thread'''
+    return await asyncio.wrap_future(_writer.submit(function, *args, **kwargs))
+
+def writes(method: Callable) -> Callable:
+    '''Marks a handler method that writes, AsyncHandler runs it on the writer thread'''
+    method.writes = True
+    return method
+
+class AsyncHandler:
+    '''
+    Sample usage:
+      ```sets = await AsyncHandler(SetHandler()).get_user_set_summaries(user_id)```
+    this will run the handler method on a database worker and await its result. Methods
+    marked with @writes run on the writer thread instead.
+
+    A method call runs entirely on one thread, so its transactions never span threads.
+    Methods returning lazy generators still return them unconsumed, see sync.
+    '''
+    def __init__(self, handler):
+        self.sync = handler
+
+    def __getattr__(self, name: str):
+        method = getattr(self.sync, name)
+        run = run_in_writer if getattr(method, "writes", False) else run_in_pool
+        async def call(*args, **kwargs):
+            return await run(method, *args, **kwargs)
+        return call
 
 class DatabaseManager:
     _instance = None
+    path = 'database.db'
 
     def __new__(cls):
         if cls._instance is None:
             cls._instance = super().__new__(cls)
-            cls._instance.connection = sqlite3.connect('database.db', check_same_thread=False)
-            cls._instance.lock = threading.Lock()  # Initialize lock
+            cls._instance._local = threading.local()  # One connection per thread
+            cls._instance._connections = []
+            cls._instance.lock = threading.Lock()  # Serializes writers only
         return cls._instance
     
     def __init__(self):
-        self.create_tables()
+        # Migrations only need to run once per process
+        if not getattr(self, "_migrated", False):
+            self.create_tables()
 
+    @property
+    def connection(self) -> sqlite3.Connection:
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = self._connect()
+            self._local.connection = connection
+        return connection
+
+    def _connect(self) -> sqlite3.Connection:
+        # Autocommit mode, transactions are opened explicitly by transaction()
+        connection = sqlite3.connect(self.path, check_same_thread=False, timeout=PRAGMAS["busy_timeout"] / 1000,
+                                     isolation_level=None, cached_statements=256)
+        for pragma, value in PRAGMAS.items():
+            connection.execute(f"PRAGMA {pragma} = {value}")
+        with self.lock:
+            self._connections.append(connection)
+        return connection
+
+    @staticmethod
+    def _is_read(query: str) -> bool:
+        return query.lstrip()[:6].upper() == "SELECT"
+
+    def _execute(self, query: str, params: Optional[list] = None) -> sqlite3.Cursor:
+        connection = self.connection
+        if self._is_read(query) or connection.in_transaction:
+            # Readers never take the lock, WAL gives each a consistent snapshot.
+            # Inside transaction() this thread already holds the lock.
+            cursor = connection.execute(query, params or ())
+        else:
+            with self.lock:  # Acquire lock, the statement commits on its own
+                cursor = connection.execute(query, params or ())
+        # Only the statement and how many values it was bound to, values may be secrets or card contents
+        logger.debug("Executed query: %s (%s params)", query, len(params or ()))
+        return cursor
 
     def execute_query(self, query: str, params: Optional[list] = None) -> list[tuple]:
-        with self.lock:  # Acquire lock
-            cursor = self.connection.cursor()
-            if params:
-                cursor.execute(query, params)
-            else:
-                cursor.execute(query)
-            self.connection.commit()
-            print(f"Executed query:\n{query}\n")
-            print(f"Params:\n{params}\n")
-            return cursor.fetchall()
+        return self._execute(query, params).fetchall()
+
+    @contextmanager
+    def transaction(self) -> Iterator[sqlite3.Connection]:
+        '''
+        Sample usage:
+          ```with transaction(): update_table(...); remove_from_table(...)```
+        this will run every statement of the block in one transaction with a single commit,
+        rolling all of them back if the block raises
+
+        Nested blocks join the outer transaction.
+        '''
+        connection = self.connection
+        if connection.in_transaction:
+            yield connection
+            return
+        with self.lock:
+            connection.execute("BEGIN IMMEDIATE")
+            try:
+                yield connection
+            except BaseException:
+                # SQLite may already have rolled back on some errors
+                if connection.in_transaction:
+                    connection.execute("ROLLBACK")
+                raise
+            connection.execute("COMMIT")
+
+    def stream_query(self, query: str, params: Optional[list] = None, chunk_size: int = 500) -> Iterator[tuple]:
+        '''
+        Sample usage:
+          ```for row in stream_query("SELECT * FROM FLASHCARD WHERE set_id = ?", [1]): ...```
+        this will yield the rows of a read query chunk_size rows at a time
+
+        A dedicated connection is opened for the lifetime of the generator, so it can be
+        consumed from any thread, e.g. by a StreamingResponse, without holding a pooled connection.
+        '''
+        connection = sqlite3.connect(self.path, check_same_thread=False, timeout=PRAGMAS["busy_timeout"] / 1000)
+        try:
+            cursor = connection.execute(query, params or ())
+            while rows := cursor.fetchmany(chunk_size):
+                yield from rows
+        finally:
+            connection.close()
 
     def create_tables(self):
-        tables = [
-            '''
-            CREATE TABLE IF NOT EXISTS USER (
-                id INTEGER PRIMARY KEY,
-                email TEXT UNIQUE,
-                password TEXT,
-                name TEXT
-            )
-            ''',
-            '''
-            CREATE TABLE IF NOT EXISTS SUPERSET (
-                id INTEGER PRIMARY KEY,
-                title TEXT,
-                user_id INTEGER,
-                FOREIGN KEY (user_id) REFERENCES USER (id)
-            )
-            ''',
-            '''
-            CREATE TABLE IF NOT EXISTS SUBSET (
-                id INTEGER PRIMARY KEY,
-                title TEXT,
-                user_id INTEGER,
-                super_id INTEGER,
-                FOREIGN KEY (user_id) REFERENCES USER (id),
-                FOREIGN KEY (super_id) REFERENCES SUPERSET (id)
-            )
-            ''',
-            '''
-            CREATE TABLE IF NOT EXISTS FLASHCARD (
-                id INTEGER PRIMARY KEY,
-                term TEXT,
-                body TEXT,
-                user_id INTEGER,
-                set_id INTEGER,
-                studied BOOLEAN DEFAULT FALSE,
-                FOREIGN KEY (user_id) REFERENCES USER (id),
-                FOREIGN KEY (set_id) REFERENCES SUBSET (id)
-            )
-            '''
-        ]
-
-        for query in tables:
-            self.execute_query(query)
+        # Bring the schema up to date, applying every pending migration in one transaction
+        connection = self.connection
+        # Table rebuilds need foreign keys off, and the pragma is a no-op inside a transaction
+        connection.execute("PRAGMA foreign_keys = OFF")
+        try:
+            with self.transaction():
+                connection.execute("CREATE TABLE IF NOT EXISTS SCHEMA_VERSION (version INTEGER NOT NULL)")
+                version = connection.execute("SELECT COALESCE(MAX(version), 0) FROM SCHEMA_VERSION").fetchone()[0]
+                for number, migration in enumerate(MIGRATIONS[version:], start=version + 1):
+                    for step in migration:
+                        if callable(step):
+                            step(connection)
+                        else:
+                            connection.execute(step)
+                    connection.execute("INSERT INTO SCHEMA_VERSION (version) VALUES (?)", [number])
+                    logger.info("Applied migration %s", number)
+                if connection.execute("PRAGMA foreign_key_check").fetchall():
+                    raise sqlite3.IntegrityError("Migrated schema violates foreign keys")
+        finally:
+            connection.execute("PRAGMA foreign_keys = ON")
+        self._migrated = True
 
     def close_connection(self):
-        self.connection.close()
+        with self.lock:
+            for connection in self._connections:
+                connection.close()
+            self._connections.clear()
+        self._local = threading.local()
+        self._migrated = False
+
+    def insert_into_table(self, table_name: str, **kwargs) -> int:
+        '''
+        Sample usage:
+          ```card_id = insert_into_table("FLASHCARD", term="term", body="body", user_id=1, set_id=1)```
+        this will insert the row and return its id
+        '''
+        logger.debug("insert_into_table(%s, %s)", table_name, tuple(kwargs))
+        query = get_table(table_name).insert(tuple(kwargs))
+        return self._execute(query, list(kwargs.values())).lastrowid
 
-    def insert_into_table(self, table_name: str, **kwargs) -> None:
-        print(f"DEBUG::DatabaseManager::insert_into_table({table_name}, {kwargs})")
-        columns = ', '.join(str(x) for x in kwargs.keys())
-        placeholders = ', '.join('?' * len(kwargs))
-        query = f"INSERT INTO {table_name} ({columns}) VALUES ({placeholders})"
-        self.execute_query(query, list(kwargs.values()))
+    def insert_many(self, table_name: str, columns: tuple[str, ...], batches: Iterable[list[tuple]]) -> Iterator[int]:
+        '''
+        Sample usage:
+          ```for count in insert_many("FLASHCARD", ("term", "body"), batches): ...```
+        this will insert every batch of rows with executemany inside one transaction,
+        yielding the running row count after each batch
+
+        The write lock is held until the generator finishes, so consume it promptly and
+        from a single thread. Closing it early rolls the whole insert back.
+        '''
+        logger.debug("insert_many(%s, %s)", table_name, columns)
+        query = get_table(table_name).insert(tuple(columns))
+        with self.transaction() as connection:
+            total = 0
+            for batch in batches:
+                connection.executemany(query, batch)
+                total += len(batch)
+                yield total
 
     def select_from_table(self, table_name, *columns, **kwargs) -> list[tuple]:
         '''
         Sample usage: 
           ```cards = select_from_table("FLASHCARD", "term", "body", user_id=1)```
         this will return all terms and bodies of the rows in the FLASHCARD table where user_id is 1
+
+        List or tuple values match any of their items:
+          ```cards = select_from_table("FLASHCARD", set_id=[1, 2, 3])```
         '''
-        if columns:
-            query = f"SELECT {', '.join(columns)} FROM {table_name}"
-        else:
-            query = f"SELECT * FROM {table_name}"
-        if kwargs:
-            conditions = ' AND '.join(f"{key} IS ?" for key in kwargs.keys())
-            query += f" WHERE {conditions}"
-            return self.execute_query(query, list(kwargs.values()))
-        else:
-            return self.execute_query(query)
+        where = []
+        params = []
+        for key, value in kwargs.items():
+            if isinstance(value, (list, tuple)):
+                where.append((key, len(value)))
+                params.extend(value)
+            else:
+                where.append(key)
+                params.append(value)
+        query = get_table(table_name).select(columns, tuple(where))
+        return self.execute_query(query, params)
         
     def update_table(self, table_name: str, new_vals: dict, **kwargs):
         '''
         Sample usage:
-          ```update_table("FLASHCARD", {"term": "new term"}, id=1)```
-        this will update the term of the row in the FLASHCARD table where the flashcard's id is 1'''
-        for key, value in new_vals.items():
-            query = f"UPDATE {table_name} SET {key} = ? WHERE {list(kwargs.keys())[0]} = ?"
-            self.execute_query(query, (value, list(kwargs.values())[0]))
-            
+          ```update_table("FLASHCARD", {"term": "new term", "body": "new body"}, id=1)```
+        this will update the term and body of the row in the FLASHCARD table where the flashcard's id is 1
+        in a single statement'''
+        key, value = next(iter(kwargs.items()))
+        query = get_table(table_name).update(tuple(new_vals), key)
+        self.execute_query(query, [*new_vals.values(), value])
     
     def remove_from_table(self, table_name: str, **kwargs) -> list[tuple]:
-        query = f"DELETE FROM {table_name} WHERE {list(kwargs.keys())[0]} = ?"
-        return self.execute_query(query, list(kwargs.values()))
+        key, value = next(iter(kwargs.items()))
+        query = get_table(table_name).delete(key)
+        return self.execute_query(query, [value])
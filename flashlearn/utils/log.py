@@ -0,0 +1,43 @@
+import atexit
+import logging
+import os
+import queue
+from logging.handlers import QueueHandler, QueueListener
+from typing import Optional
+
+# Every module logs under this name through logging.getLogger(__name__)
+LOGGER_NAME = "flashlearn"
+LOG_FORMAT = "%(asctime)s %(levelname)s %(name)s: %(message)s"
+
+def configure_logging(level: Optional[str] = None, use_queue: Optional[bool] = None) -> Optional[QueueListener]:
+    '''
+    Sample usage:
+      ```configure_logging("DEBUG", use_queue=True)```
+    this will send every flashlearn log record to stderr. With use_queue, request threads
+    only enqueue records and a background QueueListener does the writing.
+
+    Both arguments default to the FLASHLEARN_LOG_LEVEL and FLASHLEARN_LOG_QUEUE environment
+    variables. Logging stays disabled when no level is given. Returns the started listener, if any.
+    '''
+    level = level or os.environ.get("FLASHLEARN_LOG_LEVEL")
+    if not level:
+        return None
+    if use_queue is None:
+        use_queue = os.environ.get("FLASHLEARN_LOG_QUEUE", "").lower() in ("1", "true", "yes")
+
+    logger = logging.getLogger(LOGGER_NAME)
+    logger.setLevel(level.upper())
+    logger.propagate = False
+    handler = logging.StreamHandler()
+    handler.setFormatter(logging.Formatter(LOG_FORMAT))
+    if not use_queue:
+        logger.addHandler(handler)
+        return None
+
+    records = queue.SimpleQueue()
+    listener = QueueListener(records, handler, respect_handler_level=True)
+    listener.start()
+    # Flush whatever is still queued when the worker exits
+    atexit.register(listener.stop)
+    logger.addHandler(QueueHandler(records))
+    return listener
@@ -0,0 +1,423 @@
+# Ordered schema migrations applied by DatabaseManager.create_tables.
+# Migration N is MIGRATIONS[N - 1]; the applied version is kept in SCHEMA_VERSION.
+# Never edit a released migration, append a new one instead. A step is either an SQL
+# statement or a function called with the connection, for changes SQL cannot express.
+
+import sqlite3
+
+# Current unix time in SQL, unixepoch() needs SQLite 3.38
+NOW = "((julianday('now') - 2440587.5) * 86400.0)"
+
+def unique_user_names(connection: sqlite3.Connection):
+    # Every name keeps its oldest account, later ones get "-<id>" appended, plus a counter
+    # while that is still taken. NULL names stay, the unique index allows several.
+    kept = "SELECT MIN(id) FROM USER WHERE name IS NOT NULL GROUP BY name"
+    taken = {name for (name,) in connection.execute(f"SELECT name FROM USER WHERE id IN ({kept})")}
+    duplicates = connection.execute(f"SELECT id, name FROM USER WHERE name IS NOT NULL AND id NOT IN ({kept}) ORDER BY id")
+    for user_id, name in duplicates.fetchall():
+        candidate, counter = f"{name}-{user_id}", 1
+        while candidate in taken:
+            counter += 1
+            candidate = f"{name}-{user_id}-{counter}"
+        taken.add(candidate)
+        connection.execute("UPDATE USER SET name = ? WHERE id = ?", [candidate, user_id])
+
+MIGRATIONS = [
+    # 1: Original tables
+    [
+        '''
+        CREATE TABLE IF NOT EXISTS USER (
+            id INTEGER PRIMARY KEY,
+            email TEXT UNIQUE,
+            password TEXT,
+            name TEXT
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS SUPERSET (
+            id INTEGER PRIMARY KEY,
+            title TEXT,
+            user_id INTEGER,
+            FOREIGN KEY (user_id) REFERENCES USER (id)
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS SUBSET (
+            id INTEGER PRIMARY KEY,
+            title TEXT,
+            user_id INTEGER,
+            super_id INTEGER,
+            FOREIGN KEY (user_id) REFERENCES USER (id),
+            FOREIGN KEY (super_id) REFERENCES SUPERSET (id)
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS FLASHCARD (
+            id INTEGER PRIMARY KEY,
+            term TEXT,
+            body TEXT,
+            user_id INTEGER,
+            set_id INTEGER,
+            studied BOOLEAN DEFAULT FALSE,
+            FOREIGN KEY (user_id) REFERENCES USER (id),
+            FOREIGN KEY (set_id) REFERENCES SUBSET (id)
+        )
+        '''
+    ],
+    # 2: Rebuild tables with ON DELETE CASCADE foreign keys.
+    # Rows orphaned by the old multi-statement deletes are dropped, and cards
+    # that stored the owner's email as user_id are pointed at the user's id.
+    [
+        '''
+        CREATE TABLE SUPERSET_new (
+            id INTEGER PRIMARY KEY,
+            title TEXT,
+            user_id INTEGER,
+            FOREIGN KEY (user_id) REFERENCES USER (id) ON DELETE CASCADE
+        )
+        ''',
+        '''
+        INSERT INTO SUPERSET_new (id, title, user_id)
+        SELECT id, title, user_id FROM SUPERSET
+        WHERE user_id IN (SELECT id FROM USER)
+        ''',
+        '''
+        CREATE TABLE SUBSET_new (
+            id INTEGER PRIMARY KEY,
+            title TEXT,
+            user_id INTEGER,
+            super_id INTEGER,
+            FOREIGN KEY (user_id) REFERENCES USER (id) ON DELETE CASCADE,
+            FOREIGN KEY (super_id) REFERENCES SUPERSET (id) ON DELETE CASCADE
+        )
+        ''',
+        '''
+        INSERT INTO SUBSET_new (id, title, user_id, super_id)
+        SELECT id, title, user_id, super_id FROM SUBSET
+        WHERE user_id IN (SELECT id FROM USER)
+          AND (super_id IS NULL OR super_id IN (SELECT id FROM SUPERSET_new))
+        ''',
+        '''
+        CREATE TABLE FLASHCARD_new (
+            id INTEGER PRIMARY KEY,
+            term TEXT,
+            body TEXT,
+            user_id INTEGER,
+            set_id INTEGER,
+            studied BOOLEAN DEFAULT FALSE,
+            FOREIGN KEY (user_id) REFERENCES USER (id) ON DELETE CASCADE,
+            FOREIGN KEY (set_id) REFERENCES SUBSET (id) ON DELETE CASCADE
+        )
+        ''',
+        '''
+        INSERT INTO FLASHCARD_new (id, term, body, user_id, set_id, studied)
+        SELECT id, term, body, user_id, set_id, studied FROM (
+            SELECT id, term, body, set_id, studied,
+                   COALESCE((SELECT USER.id FROM USER WHERE USER.email = FLASHCARD.user_id), user_id) AS user_id
+            FROM FLASHCARD
+        )
+        WHERE user_id IN (SELECT id FROM USER)
+          AND set_id IN (SELECT id FROM SUBSET_new)
+        ''',
+        'DROP TABLE FLASHCARD',
+        'DROP TABLE SUBSET',
+        'DROP TABLE SUPERSET',
+        'ALTER TABLE SUPERSET_new RENAME TO SUPERSET',
+        'ALTER TABLE SUBSET_new RENAME TO SUBSET',
+        'ALTER TABLE FLASHCARD_new RENAME TO FLASHCARD',
+    ],
+    # 3: Secondary indexes for per-user and per-set lookups
+    [
+        'CREATE INDEX IF NOT EXISTS SUPERSET_user_id ON SUPERSET (user_id)',
+        'CREATE INDEX IF NOT EXISTS SUBSET_user_id_super_id ON SUBSET (user_id, super_id)',
+        'CREATE INDEX IF NOT EXISTS SUBSET_super_id ON SUBSET (super_id)',
+        'CREATE INDEX IF NOT EXISTS FLASHCARD_set_id_studied ON FLASHCARD (set_id, studied)',
+        'CREATE INDEX IF NOT EXISTS FLASHCARD_user_id ON FLASHCARD (user_id)',
+    ],
+    # 4: HMAC keys for signed session tokens
+    [
+        '''
+        CREATE TABLE SESSION_KEY (
+            id INTEGER PRIMARY KEY,
+            secret BLOB NOT NULL,
+            created REAL NOT NULL
+        )
+        ''',
+    ],
+    # 5: Unique user names so login can look users up by email or name in one indexed query.
+    # Existing duplicates keep the oldest account's name, later ones are renamed.
+    [
+        unique_user_names,
+        'CREATE UNIQUE INDEX USER_name ON USER (name)',
+    ],
+    # 6: Server-side study sessions with their shuffled card queue
+    [
+        '''
+        CREATE TABLE STUDY_SESSION (
+            id INTEGER PRIMARY KEY,
+            user_id INTEGER NOT NULL,
+            set_id INTEGER NOT NULL,
+            position INTEGER NOT NULL DEFAULT 0,
+            size INTEGER NOT NULL,
+            created REAL NOT NULL,
+            FOREIGN KEY (user_id) REFERENCES USER (id) ON DELETE CASCADE,
+            FOREIGN KEY (set_id) REFERENCES SUBSET (id) ON DELETE CASCADE
+        )
+        ''',
+        '''
+        CREATE TABLE STUDY_QUEUE (
+            session_id INTEGER NOT NULL,
+            position INTEGER NOT NULL,
+            card_id INTEGER NOT NULL,
+            PRIMARY KEY (session_id, position),
+            FOREIGN KEY (session_id) REFERENCES STUDY_SESSION (id) ON DELETE CASCADE,
+            FOREIGN KEY (card_id) REFERENCES FLASHCARD (id) ON DELETE CASCADE
+        ) WITHOUT ROWID
+        ''',
+        'CREATE INDEX STUDY_SESSION_user_id ON STUDY_SESSION (user_id)',
+        'CREATE INDEX STUDY_SESSION_set_id ON STUDY_SESSION (set_id)',
+        'CREATE INDEX STUDY_QUEUE_card_id ON STUDY_QUEUE (card_id)',
+    ],
+    # 7: SM-2 review schedule per card. New cards are due at 0, so they sort first in the
+    # due indexes and picking due cards is a range scan. (user_id, due) covers user_id lookups.
+    [
+        'ALTER TABLE FLASHCARD ADD COLUMN ease REAL NOT NULL DEFAULT 2.5',
+        'ALTER TABLE FLASHCARD ADD COLUMN interval REAL NOT NULL DEFAULT 0',
+        'ALTER TABLE FLASHCARD ADD COLUMN repetitions INTEGER NOT NULL DEFAULT 0',
+        'ALTER TABLE FLASHCARD ADD COLUMN due REAL NOT NULL DEFAULT 0',
+        'ALTER TABLE FLASHCARD ADD COLUMN reviewed REAL NOT NULL DEFAULT 0',
+        'CREATE INDEX FLASHCARD_set_id_due ON FLASHCARD (set_id, due)',
+        'CREATE INDEX FLASHCARD_user_id_due ON FLASHCARD (user_id, due)',
+        'DROP INDEX FLASHCARD_user_id',
+    ],
+    # 8: Review state moves out of FLASHCARD into one row per (learner, card), created on
+    # the first review. set_id is copied from the card so a learner's due cards of a set
+    # stay a range scan. Existing progress belongs to the card's owner.
+    [
+        '''
+        CREATE TABLE CARD_STATE (
+            user_id INTEGER NOT NULL,
+            card_id INTEGER NOT NULL,
+            set_id INTEGER NOT NULL,
+            ease REAL NOT NULL DEFAULT 2.5,
+            interval REAL NOT NULL DEFAULT 0,
+            repetitions INTEGER NOT NULL DEFAULT 0,
+            due REAL NOT NULL DEFAULT 0,
+            reviewed REAL NOT NULL DEFAULT 0,
+            PRIMARY KEY (user_id, card_id),
+            FOREIGN KEY (user_id) REFERENCES USER (id) ON DELETE CASCADE,
+            FOREIGN KEY (card_id) REFERENCES FLASHCARD (id) ON DELETE CASCADE,
+            FOREIGN KEY (set_id) REFERENCES SUBSET (id) ON DELETE CASCADE
+        ) WITHOUT ROWID
+        ''',
+        '''
+        INSERT INTO CARD_STATE (user_id, card_id, set_id, ease, interval, repetitions, due, reviewed)
+        SELECT user_id, id, set_id, ease, interval, repetitions, due, reviewed FROM FLASHCARD
+        WHERE studied OR reviewed > 0
+        ''',
+        'CREATE INDEX CARD_STATE_user_id_set_id_due ON CARD_STATE (user_id, set_id, due)',
+        'CREATE INDEX CARD_STATE_card_id ON CARD_STATE (card_id)',
+        'CREATE INDEX CARD_STATE_set_id ON CARD_STATE (set_id)',
+        '''
+        CREATE TABLE FLASHCARD_new (
+            id INTEGER PRIMARY KEY,
+            term TEXT,
+            body TEXT,
+            user_id INTEGER,
+            set_id INTEGER,
+            FOREIGN KEY (user_id) REFERENCES USER (id) ON DELETE CASCADE,
+            FOREIGN KEY (set_id) REFERENCES SUBSET (id) ON DELETE CASCADE
+        )
+        ''',
+        'INSERT INTO FLASHCARD_new (id, term, body, user_id, set_id) SELECT id, term, body, user_id, set_id FROM FLASHCARD',
+        'DROP TABLE FLASHCARD',
+        'ALTER TABLE FLASHCARD_new RENAME TO FLASHCARD',
+        'CREATE INDEX FLASHCARD_set_id ON FLASHCARD (set_id)',
+        'CREATE INDEX FLASHCARD_user_id ON FLASHCARD (user_id)',
+    ],
+    # 9: Content versions for cache validation. Triggers bump a set's version and modified
+    # time (unix seconds) whenever its title or cards change, and a super set's whenever it
+    # or one of its sets changes, so every write path is covered including bulk imports.
+    [
+        'ALTER TABLE SUBSET ADD COLUMN version INTEGER NOT NULL DEFAULT 1',
+        'ALTER TABLE SUBSET ADD COLUMN modified REAL NOT NULL DEFAULT 0',
+        'ALTER TABLE SUPERSET ADD COLUMN version INTEGER NOT NULL DEFAULT 1',
+        'ALTER TABLE SUPERSET ADD COLUMN modified REAL NOT NULL DEFAULT 0',
+        f'UPDATE SUBSET SET modified = {NOW}',
+        f'UPDATE SUPERSET SET modified = {NOW}',
+        f'''
+        CREATE TRIGGER FLASHCARD_insert_version AFTER INSERT ON FLASHCARD BEGIN
+            UPDATE SUBSET SET version = version + 1, modified = {NOW} WHERE id = NEW.set_id;
+        END
+        ''',
+        f'''
+        CREATE TRIGGER FLASHCARD_update_version AFTER UPDATE OF term, body, set_id ON FLASHCARD BEGIN
+            UPDATE SUBSET SET version = version + 1, modified = {NOW} WHERE id IN (OLD.set_id, NEW.set_id);
+        END
+        ''',
+        f'''
+        CREATE TRIGGER FLASHCARD_delete_version AFTER DELETE ON FLASHCARD BEGIN
+            UPDATE SUBSET SET version = version + 1, modified = {NOW} WHERE id = OLD.set_id;
+        END
+        ''',
+        f'''
+        CREATE TRIGGER SUBSET_insert_version AFTER INSERT ON SUBSET BEGIN
+            UPDATE SUBSET SET modified = {NOW} WHERE id = NEW.id;
+            UPDATE SUPERSET SET version = version + 1, modified = {NOW} WHERE id = NEW.super_id;
+        END
+        ''',
+        f'''
+        CREATE TRIGGER SUBSET_update_version AFTER UPDATE OF title, super_id ON SUBSET BEGIN
+            UPDATE SUBSET SET version = version + 1, modified = {NOW} WHERE id = NEW.id;
+            UPDATE SUPERSET SET version = version + 1, modified = {NOW} WHERE id = OLD.super_id;
+        END
+        ''',
+        f'''
+        CREATE TRIGGER SUBSET_content_version AFTER UPDATE OF version ON SUBSET BEGIN
+            UPDATE SUPERSET SET version = version + 1, modified = {NOW} WHERE id = NEW.super_id;
+        END
+        ''',
+        f'''
+        CREATE TRIGGER SUBSET_delete_version AFTER DELETE ON SUBSET BEGIN
+            UPDATE SUPERSET SET version = version + 1, modified = {NOW} WHERE id = OLD.super_id;
+        END
+        ''',
+        f'''
+        CREATE TRIGGER SUPERSET_insert_version AFTER INSERT ON SUPERSET BEGIN
+            UPDATE SUPERSET SET modified = {NOW} WHERE id = NEW.id;
+        END
+        ''',
+        f'''
+        CREATE TRIGGER SUPERSET_update_version AFTER UPDATE OF title ON SUPERSET BEGIN
+            UPDATE SUPERSET SET version = version + 1, modified = {NOW} WHERE id = NEW.id;
+        END
+        ''',
+    ],
+    # 10: Full-text index over card terms and bodies. CARD_SEARCH is an external content
+    # FTS5 table reading its text from FLASHCARD, the triggers keep its index in sync and
+    # 'rebuild' backfills the existing cards. Prefix indexes serve search-as-you-type. A future FLASHCARD rebuild must recreate the triggers.
+    [
+        '''
+        CREATE VIRTUAL TABLE CARD_SEARCH USING fts5(
+            term, body, content='FLASHCARD', content_rowid='id',
+            tokenize='unicode61 remove_diacritics 2', prefix='2 3 4'
+        )
+        ''',
+        '''
+        CREATE TRIGGER FLASHCARD_search_insert AFTER INSERT ON FLASHCARD BEGIN
+            INSERT INTO CARD_SEARCH (rowid, term, body) VALUES (NEW.id, NEW.term, NEW.body);
+        END
+        ''',
+        '''
+        CREATE TRIGGER FLASHCARD_search_delete AFTER DELETE ON FLASHCARD BEGIN
+            INSERT INTO CARD_SEARCH (CARD_SEARCH, rowid, term, body) VALUES ('delete', OLD.id, OLD.term, OLD.body);
+        END
+        ''',
+        '''
+        CREATE TRIGGER FLASHCARD_search_update AFTER UPDATE OF term, body ON FLASHCARD BEGIN
+            INSERT INTO CARD_SEARCH (CARD_SEARCH, rowid, term, body) VALUES ('delete', OLD.id, OLD.term, OLD.body);
+            INSERT INTO CARD_SEARCH (rowid, term, body) VALUES (NEW.id, NEW.term, NEW.body);
+        END
+        ''',
+        "INSERT INTO CARD_SEARCH (CARD_SEARCH) VALUES ('rebuild')",
+    ],
+    # 11: Version of everything a user's set pages show, for the rendered page cache. Set
+    # versions already cover card changes, study progress only counts whether a state exists.
+    [
+        'ALTER TABLE USER ADD COLUMN version INTEGER NOT NULL DEFAULT 1',
+        'ALTER TABLE USER ADD COLUMN modified REAL NOT NULL DEFAULT 0',
+        f'UPDATE USER SET modified = {NOW}',
+        f'''
+        CREATE TRIGGER SUBSET_insert_user_version AFTER INSERT ON SUBSET BEGIN
+            UPDATE USER SET version = version + 1, modified = {NOW} WHERE id = NEW.user_id;
+        END
+        ''',
+        f'''
+        CREATE TRIGGER SUBSET_update_user_version AFTER UPDATE OF version ON SUBSET BEGIN
+            UPDATE USER SET version = version + 1, modified = {NOW} WHERE id = NEW.user_id;
+        END
+        ''',
+        f'''
+        CREATE TRIGGER SUBSET_delete_user_version AFTER DELETE ON SUBSET BEGIN
+            UPDATE USER SET version = version + 1, modified = {NOW} WHERE id = OLD.user_id;
+        END
+        ''',
+        f'''
+        CREATE TRIGGER SUPERSET_insert_user_version AFTER INSERT ON SUPERSET BEGIN
+            UPDATE USER SET version = version + 1, modified = {NOW} WHERE id = NEW.user_id;
+        END
+        ''',
+        f'''
+        CREATE TRIGGER SUPERSET_update_user_version AFTER UPDATE OF title ON SUPERSET BEGIN
+            UPDATE USER SET version = version + 1, modified = {NOW} WHERE id = NEW.user_id;
+        END
+        ''',
+        f'''
+        CREATE TRIGGER SUPERSET_delete_user_version AFTER DELETE ON SUPERSET BEGIN
+            UPDATE USER SET version = version + 1, modified = {NOW} WHERE id = OLD.user_id;
+        END
+        ''',
+        f'''
+        CREATE TRIGGER CARD_STATE_insert_user_version AFTER INSERT ON CARD_STATE BEGIN
+            UPDATE USER SET version = version + 1, modified = {NOW} WHERE id = NEW.user_id;
+        END
+        ''',
+        f'''
+        CREATE TRIGGER CARD_STATE_delete_user_version AFTER DELETE ON CARD_STATE BEGIN
+            UPDATE USER SET version = version + 1, modified = {NOW} WHERE id = OLD.user_id;
+        END
+        ''',
+    ],
+    # 12: SM-2 parameters the stored due dates were computed with, see StudyHandler.apply_params
+    [
+        '''
+        CREATE TABLE SCHEDULER_PARAMS (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            min_ease REAL NOT NULL,
+            interval_modifier REAL NOT NULL,
+            max_interval REAL NOT NULL
+        )
+        ''',
+    ],
+    # 13: Session epoch, bumped on password change. Tokens carry the epoch they were issued
+    # under and are only renewed while it still matches, see deps.get_current_user
+    [
+        'ALTER TABLE USER ADD COLUMN session_epoch INTEGER NOT NULL DEFAULT 0',
+    ],
+    # 14: Owner token in the full-text index, so a search matches "owner:u<id> AND (...)" and
+    # bm25 only ranks the user's own cards. The owner is not a FLASHCARD column, so the
+    # index reads its content through the CARD_SEARCH_CONTENT view.
+    [
+        'DROP TRIGGER FLASHCARD_search_insert',
+        'DROP TRIGGER FLASHCARD_search_delete',
+        'DROP TRIGGER FLASHCARD_search_update',
+        'DROP TABLE CARD_SEARCH',
+        """
+        CREATE VIEW CARD_SEARCH_CONTENT AS
+        SELECT id, term, body, 'u' || user_id AS owner FROM FLASHCARD
+        """,
+        '''
+        CREATE VIRTUAL TABLE CARD_SEARCH USING fts5(
+            term, body, owner, content='CARD_SEARCH_CONTENT', content_rowid='id',
+            tokenize='unicode61 remove_diacritics 2', prefix='2 3 4'
+        )
+        ''',
+        '''
+        CREATE TRIGGER FLASHCARD_search_insert AFTER INSERT ON FLASHCARD BEGIN
+            INSERT INTO CARD_SEARCH (rowid, term, body, owner) VALUES (NEW.id, NEW.term, NEW.body, 'u' || NEW.user_id);
+        END
+        ''',
+        '''
+        CREATE TRIGGER FLASHCARD_search_delete AFTER DELETE ON FLASHCARD BEGIN
+            INSERT INTO CARD_SEARCH (CARD_SEARCH, rowid, term, body, owner) VALUES ('delete', OLD.id, OLD.term, OLD.body, 'u' || OLD.user_id);
+        END
+        ''',
+        '''
+        CREATE TRIGGER FLASHCARD_search_update AFTER UPDATE OF term, body, user_id ON FLASHCARD BEGIN
+            INSERT INTO CARD_SEARCH (CARD_SEARCH, rowid, term, body, owner) VALUES ('delete', OLD.id, OLD.term, OLD.body, 'u' || OLD.user_id);
+            INSERT INTO CARD_SEARCH (rowid, term, body, owner) VALUES (NEW.id, NEW.term, NEW.body, 'u' || NEW.user_id);
+        END
+        ''',
+        "INSERT INTO CARD_SEARCH (CARD_SEARCH) VALUES ('rebuild')",
+    ],
+]
@@ -0,0 +1,71 @@
+import os
+from dataclasses import dataclass
+
+# SM-2 spaced repetition. A card's stored interval is the plain SM-2 interval in days, the
+# deck-wide parameters below only shape how that interval turns into a due timestamp, so
+# they can change without replaying any review history (see RESCHEDULE_CARDS).
+DAY = 86400.0
+INITIAL_EASE = 2.5
+# Reviews graded below this count as a lapse and restart the card
+PASSING_GRADE = 3
+# Grades of the study page's answer buttons, skipping a card is not a review
+GRADES = {"forgot": 1, "hard": 3, "studied": 4, "easy": 5}
+
+@dataclass(frozen=True)
+class SchedulerParams:
+    """Deck-wide scheduling parameters"""
+    min_ease: float = 1.3
+    """Lower bound of a card's ease factor"""
+    interval_modifier: float = 1.0
+    """Multiplier applied to every interval when computing due dates"""
+    max_interval: float = 36500.0
+    """Longest gap between two reviews, in days"""
+
+DEFAULT_PARAMS = SchedulerParams(
+    min_ease=float(os.environ.get("FLASHLEARN_SM2_MIN_EASE", 1.3)),
+    interval_modifier=float(os.environ.get("FLASHLEARN_SM2_INTERVAL_MODIFIER", 1.0)),
+    max_interval=float(os.environ.get("FLASHLEARN_SM2_MAX_INTERVAL", 36500.0)),
+)
+
+@dataclass
+class Schedule:
+    """Review state of a card"""
+    ease: float = INITIAL_EASE
+    """SM-2 ease factor"""
+    interval: float = 0.0
+    """SM-2 interval in days, before interval_modifier and max_interval"""
+    repetitions: int = 0
+    """Successful reviews in a row"""
+    due: float = 0.0
+    """Unix timestamp the card is due at, 0 for new cards"""
+    reviewed: float = 0.0
+    """Unix timestamp of the last review, 0 for new cards"""
+
+def due_at(reviewed: float, interval: float, params: SchedulerParams = DEFAULT_PARAMS) -> float:
+    '''Same formula as RESCHEDULE_CARDS, keep the two in sync'''
+    return reviewed + min(interval * params.interval_modifier, params.max_interval) * DAY
+
+def review(schedule: Schedule, grade: int, now: float, params: SchedulerParams = DEFAULT_PARAMS) -> Schedule:
+    '''Returns the schedule after a review graded 0 (blackout) to 5 (perfect recall)'''
+    if grade >= PASSING_GRADE:
+        if schedule.repetitions == 0:
+            interval = 1.0
+        elif schedule.repetitions == 1:
+            interval = 6.0
+        else:
+            interval = float(round(schedule.interval * schedule.ease))
+        repetitions = schedule.repetitions + 1
+    else:
+        interval = 1.0
+        repetitions = 0
+    ease = max(params.min_ease, schedule.ease + 0.1 - (5 - grade) * (0.08 + (5 - grade) * 0.02))
+    return Schedule(ease, interval, repetitions, due_at(now, interval, params), now)
+
+# Recomputes the due dates of every reviewed card for new parameters with one set-based
+# statement. Parameters: min_ease, interval_modifier, max_interval.
+RESCHEDULE_CARDS = '''
+    UPDATE CARD_STATE
+    SET ease = max(ease, ?1),
+        due = reviewed + min(interval * ?2, ?3) * 86400.0
+    WHERE reviewed > 0
+'''
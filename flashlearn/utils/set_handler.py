@@ -1,152 +1,431 @@
-from typing import Optional
-import random
+from typing import BinaryIO, Iterator, Optional
+import codecs
+import csv
+import logging
+import os
 
-from flashlearn.utils.database import DatabaseManager
+from flashlearn.utils.cache import TTLCache
+from flashlearn.utils.database import AsyncHandler, DatabaseManager, writes
 from flashlearn.models.card import Card
-from flashlearn.models.sets import AbstractSet, Set, SuperSet
+from flashlearn.models.sets import AbstractSet, Set, SuperSet, SetSummary
+from flashlearn.models.search import MATCH_END, MATCH_START, SearchResult
+from flashlearn.utils.tables import FLASHCARD, USER
+
+logger = logging.getLogger(__name__)
+
+# Prepared statements for the hottest lookups
+GET_CARD = FLASHCARD.select(where=("id",))
+# Sets and super sets are only read by their owner, like DECK_VERSION
+GET_SET = "SELECT id, title FROM SUBSET WHERE id = ? AND user_id = ?"
+GET_SUPER_SET = "SELECT id, title FROM SUPERSET WHERE id = ? AND user_id = ?"
+# Version of everything a user's set pages show, kept by triggers on every write path
+PAGE_VERSION = USER.select(("version", "modified"), where=("id",))
+
+# Rendered set pages by (user, page version, page), see api.cached_page. Versions live in
+# the database, so a write through any worker moves every worker to fresh entries.
+PAGE_CACHE_SIZE = int(os.environ.get("FLASHLEARN_PAGE_CACHE_SIZE", 1024))
+page_cache = TTLCache(maxsize=PAGE_CACHE_SIZE, ttl=3600, name="pages")
+
+# Cards per page of a set and sets per page of a super set, pages are keyed on the last id shown
+PAGE_SIZE = int(os.environ.get("FLASHLEARN_PAGE_SIZE", 50))
+MAX_PAGE_SIZE = 500
+
+# Next page of a set's cards, a range scan over the set_id index which also orders by id,
+# so every page costs the same as the first
+CARD_PAGE = "SELECT * FROM FLASHCARD WHERE set_id = ? AND id > ? ORDER BY id LIMIT ?"
+
+# Next page of a super set's sets with their card counts, without loading any cards
+SET_SUMMARY_PAGE = '''
+    SELECT SUBSET.id, SUBSET.title, 'set', COUNT(FLASHCARD.id), COUNT(CARD_STATE.card_id)
+    FROM SUBSET
+    LEFT JOIN FLASHCARD ON FLASHCARD.set_id = SUBSET.id
+    LEFT JOIN CARD_STATE ON CARD_STATE.user_id = SUBSET.user_id AND CARD_STATE.card_id = FLASHCARD.id
+    WHERE SUBSET.super_id = ? AND SUBSET.id > ?
+    GROUP BY SUBSET.id
+    ORDER BY SUBSET.id
+    LIMIT ?
+'''
+
+# Number of cards inserted per executemany call during imports
+IMPORT_BATCH_SIZE = 500
+# First rows of an import file that name its columns instead of holding a card
+IMPORT_HEADERS = {("term", "body"), ("term", "definition")}
+
+# Columns of the rows yielded by SetHandler.export_cards
+EXPORT_COLUMNS = ("super_id", "super_title", "set_id", "set_title", "card_id", "term", "body", "studied")
+
+# Every set of a user with its cards, empty sets yield a single row without a card
+EXPORT_QUERY = '''
+    SELECT SUPERSET.id, SUPERSET.title, SUBSET.id, SUBSET.title,
+           FLASHCARD.id, FLASHCARD.term, FLASHCARD.body, CARD_STATE.card_id IS NOT NULL
+    FROM SUBSET
+    LEFT JOIN SUPERSET ON SUPERSET.id = SUBSET.super_id
+    LEFT JOIN FLASHCARD ON FLASHCARD.set_id = SUBSET.id
+    LEFT JOIN CARD_STATE ON CARD_STATE.user_id = SUBSET.user_id AND CARD_STATE.card_id = FLASHCARD.id
+    WHERE SUBSET.user_id = ?
+'''
+# Super sets of a user holding no set, which EXPORT_QUERY cannot reach from SUBSET. They
+# yield a single row without a set, appended with UNION ALL.
+EXPORT_EMPTY_SUPER_SETS = '''
+    SELECT SUPERSET.id, SUPERSET.title, NULL, NULL, NULL, NULL, NULL, 0
+    FROM SUPERSET
+    WHERE SUPERSET.user_id = ? AND NOT EXISTS (SELECT 1 FROM SUBSET WHERE SUBSET.super_id = SUPERSET.id)
+'''
+
+# Top level sets and super sets of a user with their card counts and how many of those
+# cards the user reviewed, aggregated in SQL
+SUMMARY_QUERY = '''
+    SELECT SUBSET.id, SUBSET.title, 'set', COUNT(FLASHCARD.id), COUNT(CARD_STATE.card_id)
+    FROM SUBSET
+    LEFT JOIN FLASHCARD ON FLASHCARD.set_id = SUBSET.id
+    LEFT JOIN CARD_STATE ON CARD_STATE.user_id = SUBSET.user_id AND CARD_STATE.card_id = FLASHCARD.id
+    WHERE SUBSET.user_id = ? AND SUBSET.super_id IS NULL
+    GROUP BY SUBSET.id
+    UNION ALL
+    SELECT SUPERSET.id, SUPERSET.title, 'super_set', COUNT(FLASHCARD.id), COUNT(CARD_STATE.card_id)
+    FROM SUPERSET
+    LEFT JOIN SUBSET ON SUBSET.super_id = SUPERSET.id
+    LEFT JOIN FLASHCARD ON FLASHCARD.set_id = SUBSET.id
+    LEFT JOIN CARD_STATE ON CARD_STATE.user_id = SUPERSET.user_id AND CARD_STATE.card_id = FLASHCARD.id
+    WHERE SUPERSET.user_id = ?
+    GROUP BY SUPERSET.id
+'''
+
+# Version and modification time of a user's set or super set, a primary key lookup
+DECK_VERSION = {
+    "set": "SELECT version, modified FROM SUBSET WHERE id = ? AND user_id = ?",
+    "super_set": "SELECT version, modified FROM SUPERSET WHERE id = ? AND user_id = ?",
+}
+
+# Everything an offline client needs to study a set or a super set, in one query. Rows are
+# (version, modified, title, set_id, set_title, card_id, term, body), ordered by set and card.
+DECK_PAYLOAD = {
+    "set": '''
+        SELECT SUBSET.version, SUBSET.modified, SUBSET.title, SUBSET.id, SUBSET.title,
+               FLASHCARD.id, FLASHCARD.term, FLASHCARD.body
+        FROM SUBSET LEFT JOIN FLASHCARD ON FLASHCARD.set_id = SUBSET.id
+        WHERE SUBSET.id = ? AND SUBSET.user_id = ?
+        ORDER BY FLASHCARD.id
+    ''',
+    "super_set": '''
+        SELECT SUPERSET.version, SUPERSET.modified, SUPERSET.title, SUBSET.id, SUBSET.title,
+               FLASHCARD.id, FLASHCARD.term, FLASHCARD.body
+        FROM SUPERSET
+        LEFT JOIN SUBSET ON SUBSET.super_id = SUPERSET.id
+        LEFT JOIN FLASHCARD ON FLASHCARD.set_id = SUBSET.id
+        WHERE SUPERSET.id = ? AND SUPERSET.user_id = ?
+        ORDER BY SUBSET.id, FLASHCARD.id
+    ''',
+}
+
+# Search results per page
+SEARCH_PAGE_SIZE = 20
+
+# A user's cards matching an FTS5 query from match_query, best first. bm25 weighs a match in
+# the term twice as much as one in the body and ignores the owner column, which only filters.
+# The owner is not checked again on FLASHCARD, that would let the planner scan the user's
+# cards and probe the index once per card. Parameters: match, limit, offset.
+SEARCH_QUERY = f'''
+    SELECT FLASHCARD.id, FLASHCARD.term, FLASHCARD.body, FLASHCARD.user_id, FLASHCARD.set_id,
+           highlight(CARD_SEARCH, 0, '{MATCH_START}', '{MATCH_END}'),
+           snippet(CARD_SEARCH, 1, '{MATCH_START}', '{MATCH_END}', '…', 24)
+    FROM CARD_SEARCH JOIN FLASHCARD ON FLASHCARD.id = CARD_SEARCH.rowid
+    WHERE CARD_SEARCH MATCH ?
+    ORDER BY bm25(CARD_SEARCH, 2.0, 1.0, 0.0)
+    LIMIT ? OFFSET ?
+'''
+
+def match_query(text: str, user_id: int) -> str:
+    '''
+    Turns typed text into an FTS5 query matching the user's cards that contain every word.
+    Words are quoted so FTS5 operators in them are matched literally. The last word also
+    matches as a prefix once it is long enough to use CARD_SEARCH's prefix index. Returns
+    an empty string for blank text.
+    '''
+    words = text.split()
+    if not words:
+        return ""
+    quoted = ['"' + word.replace('"', '""') + '"' for word in words]
+    if len(words[-1]) >= 2:
+        quoted[-1] += "*"
+    # The owner column narrows the match inside the index, before any card is ranked
+    return f'owner:"u{user_id}" AND ({" ".join(quoted)})'
 
 class SetHandler:
     def __init__(self):
         self._db = DatabaseManager()
 
+    @writes
     def create_set(self, name: str, user_id: int, super_id: Optional[int] = None) -> Set:
-        print(f"DEBUG::Set Handler::create_set(\"{name}\", {user_id}, {super_id})")
+        logger.debug("create_set(%r, %s, %s)", name, user_id, super_id)
         # Insert set into database
         if super_id is None:
-            self._db.insert_into_table("SUBSET", title=name, user_id=user_id)
+            set_id = self._db.insert_into_table("SUBSET", title=name, user_id=user_id)
         else:
-            self._db.insert_into_table("SUBSET", title=name, user_id=user_id, super_id=super_id)
-        # Return set object if found
-        info = self._db.select_from_table("SUBSET", title=name, user_id=user_id)
-        if not info:
-            return None
-        info = info[0]
-        return Set(info[0], info[1], [])
+            set_id = self._db.insert_into_table("SUBSET", title=name, user_id=user_id, super_id=super_id)
+        # Return set object built from the new row id
+        return Set(set_id, name, [])
     
+    @writes
     def create_super_set(self, name: str, user_id: int):
-        print(f"DEBUG::Set Handler::create_super_set(\"{name}\", {user_id})")
+        logger.debug("create_super_set(%r, %s)", name, user_id)
         # Insert set into database
-        self._db.insert_into_table("SUPERSET", title=name, user_id=user_id)
-        # Return set object if found
-        info = self._db.select_from_table("SUPERSET", title=name, user_id=user_id)
-        if not info:
-            return None
-        info = info[0]
-        return SuperSet(info[0], info[1], [])
+        super_id = self._db.insert_into_table("SUPERSET", title=name, user_id=user_id)
+        # Return set object built from the new row id
+        return SuperSet(super_id, name, [])
     
     def _populate_set(self, set_id: int):
-        print(f"DEBUG::Set Handler::_populate_set({set_id})")
+        logger.debug("_populate_set(%s)", set_id)
         # Get cards given set
         cards = self._db.select_from_table("FLASHCARD", set_id=set_id)
         # Populate array with card objects
         return [Card(*info) for info in cards]
     
     def _populate_super_set(self, super_id: int):
-        print(f"DEBUG::Set Handler::_populate_super_set({super_id})")
+        logger.debug("_populate_super_set(%s)", super_id)
         # Get sets given super set
         sets = self._db.select_from_table("SUBSET", "id", "title", super_id=super_id)
         # Populate sets with cards before returning
-        return [Set(*info, self._populate_set(info[0])) for info in sets]
+        return self._load_sets(sets)
 
-    def get_set(self, set_id: int) -> Set:
-        print(f"DEBUG::Set Handler::get_set({set_id})")
-        # Get set info
-        info = self._db.select_from_table("SUBSET", id=set_id)
+    def _load_sets(self, sets: list[tuple]) -> list[Set]:
+        logger.debug("_load_sets(%s sets)", len(sets))
+        # Get cards of every set in one query and group them by set
+        cards = {info[0]: [] for info in sets}
+        if cards:
+            for info in self._db.select_from_table("FLASHCARD", set_id=list(cards)):
+                cards[info[4]].append(Card(*info))
+        return [Set(info[0], info[1], cards[info[0]]) for info in sets]
+
+    def _load_super_sets(self, super_sets: list[tuple]) -> list[SuperSet]:
+        logger.debug("_load_super_sets(%s super sets)", len(super_sets))
+        # Get subsets of every super set in one query, then their cards in another
+        subsets = {info[0]: [] for info in super_sets}
+        if subsets:
+            sets = self._db.select_from_table("SUBSET", "id", "title", "super_id", super_id=list(subsets))
+            for loaded, info in zip(self._load_sets(sets), sets):
+                subsets[info[2]].append(loaded)
+        return [SuperSet(info[0], info[1], subsets[info[0]]) for info in super_sets]
+
+    def get_set(self, set_id: int, user_id: int, after: int = 0, limit: Optional[int] = None) -> Optional[Set]:
+        '''
+        Returns the set with every card, or with limit cards whose id follows after. A page
+        that is followed by more cards has next_cursor set, pass it as after for the next one.
+        None if the user owns no such set.
+        '''
+        logger.debug("get_set(%s, %s, %s, %s)", set_id, user_id, after, limit)
+        # Get set info, only from the user's own sets
+        info = self._db.execute_query(GET_SET, [set_id, user_id])
+        if not info:
+            return None
         # Return set object
         info = info[0]
-        return Set(info[0], info[1], self._populate_set(set_id))
+        if limit is None:
+            return Set(info[0], info[1], self._populate_set(set_id))
+        # Read one card more than shown to know whether another page follows
+        cards = [Card(*card) for card in self._db.execute_query(CARD_PAGE, [set_id, after, limit + 1])]
+        next_cursor = cards[limit - 1].id if len(cards) > limit else None
+        return Set(info[0], info[1], cards[:limit], next_cursor)
     
-    def get_super_set(self, super_id: int) -> SuperSet:
-        print(f"DEBUG::Set Handler::get_super_set({super_id})")
-        # Get super set info
-        info = self._db.select_from_table("SUPERSET", id=super_id)
+    def get_super_set(self, super_id: int, user_id: int, after: int = 0, limit: Optional[int] = None) -> Optional[SuperSet]:
+        '''
+        Returns the super set with every set and card, or with summaries of limit sets whose
+        id follows after, paged like get_set. None if the user owns no such super set.
+        '''
+        logger.debug("get_super_set(%s, %s, %s, %s)", super_id, user_id, after, limit)
+        # Get super set info, only from the user's own super sets
+        info = self._db.execute_query(GET_SUPER_SET, [super_id, user_id])
+        if not info:
+            return None
         # Return super set object
         info = info[0]
-        return SuperSet(info[0], info[1], self._populate_super_set(super_id))
+        if limit is None:
+            return SuperSet(info[0], info[1], self._populate_super_set(super_id))
+        sets = [SetSummary(*row) for row in self._db.execute_query(SET_SUMMARY_PAGE, [super_id, after, limit + 1])]
+        next_cursor = sets[limit - 1].id if len(sets) > limit else None
+        return SuperSet(info[0], info[1], sets[:limit], next_cursor)
     
     def get_user_sets(self, user_id: int) -> list[AbstractSet]:
-        print(f"DEBUG::Set Handler::get_user_sets({user_id})")
+        logger.debug("get_user_sets(%s)", user_id)
         # Get sets and super sets
         sets = self._db.select_from_table("SUBSET", user_id=user_id, super_id=None)
         super_sets = self._db.select_from_table("SUPERSET", user_id=user_id)
-        # Return list of sets and super sets
-        return ([Set(info[0], info[1], self._populate_set(info[0])) for info in sets] 
-                +
-                [SuperSet(info[0], info[1], self._populate_super_set(info[0])) for info in super_sets])
+        # Return list of sets and super sets, loaded in a fixed number of queries
+        return self._load_sets(sets) + self._load_super_sets(super_sets)
     
+    def get_user_set_summaries(self, user_id: int) -> list[SetSummary]:
+        logger.debug("get_user_set_summaries(%s)", user_id)
+        # Get titles and card counts without loading any cards
+        rows = self._db.execute_query(SUMMARY_QUERY, [user_id, user_id])
+        return [SetSummary(*info) for info in rows]
+
     def get_subsets(self, super_id: int) -> list[Set]:
-        print(f"DEBUG::Set Handler::get_subsets({super_id})")
+        logger.debug("get_subsets(%s)", super_id)
         # Get sets given super set
-        sets = self._db.select_from_table("SUBSET", super_id=super_id)
+        sets = self._db.select_from_table("SUBSET", "id", "title", super_id=super_id)
         # Populate sets with cards before returning
-        return [Set(info[0], info[1], self._populate_set(info[0])) for info in sets]
+        return self._load_sets(sets)
     
+    @writes
     def edit_set(self, set_id: int, new_title: str):
-        print(f"DEBUG::Set Handler::edit_set({set_id}, \"{new_title}\")")
-        # Update set title
-        self._db.update_table("SUBSET", {"title": new_title}, id=set_id)
+        logger.debug("edit_set(%s, %r)", set_id, new_title)
+        # Update set title and read it back in one transaction
+        with self._db.transaction():
+            self._db.update_table("SUBSET", {"title": new_title}, id=set_id)
+            info = self._db.select_from_table("SUBSET", id=set_id)
         # Return updated set object if found
-        info = self._db.select_from_table("SUBSET", id=set_id)
         if not info:
             return None
         info = info[0]
         return Set(info[0], info[1], self._populate_set(set_id))
     
+    @writes
     def edit_super_set(self, super_id: int, new_title: str):
-        print(f"DEBUG::Set Handler::edit_super_set({super_id}, \"{new_title}\")")
-        # Update super set title
-        self._db.update_table("SUPERSET", {"title": new_title}, id=super_id)
+        logger.debug("edit_super_set(%s, %r)", super_id, new_title)
+        # Update super set title and read it back in one transaction
+        with self._db.transaction():
+            self._db.update_table("SUPERSET", {"title": new_title}, id=super_id)
+            info = self._db.select_from_table("SUPERSET", id=super_id)
         # Return updated super set object if found
-        info = self._db.select_from_table("SUPERSET", id=super_id)
         if not info:
             return None
         info = info[0]
         return SuperSet(info[0], info[1], self._populate_super_set(super_id))
 
+    @writes
     def delete_set(self, set_id: int):
-        print(f"DEBUG::Set Handler::delete_set({set_id})")
-        # Delete set from database
+        logger.debug("delete_set(%s)", set_id)
+        # Delete set from database, its cards are removed by ON DELETE CASCADE
         self._db.remove_from_table("SUBSET", id=set_id)
-        self._db.remove_from_table("FLASHCARD", set_id=set_id)
         # Return True if set is deleted
         info = self._db.select_from_table("SUBSET", id=set_id)
         if not info:
             return True
         return False
     
+    @writes
     def delete_super_set(self, super_id: int):
-        print(f"DEBUG::Set Handler::delete_super_set({super_id})")
-        # Delete super set from database
+        logger.debug("delete_super_set(%s)", super_id)
+        # Delete super set from database, its subsets and cards are removed by ON DELETE CASCADE
         self._db.remove_from_table("SUPERSET", id=super_id)
-        self._db.remove_from_table("SUBSET", super_id=super_id)
         info = self._db.select_from_table("SUPERSET", id=super_id)
         if not info:
             return True
         return False
 
+    @writes
     def add_card_to_set(self, set_id: int, user_id: int, term: str, body: str) -> Card:
-        print(f"DEBUG::Set Handler::add_card_to_set({set_id}, {user_id}, \"{term}\", \"{body}\")")
+        logger.debug("add_card_to_set(%s, %s, %r, %r)", set_id, user_id, term, body)
         # Insert card into database
-        self._db.insert_into_table("FLASHCARD", term=term, body=body, user_id=user_id, set_id=set_id)
-        # Return card object if found
-        info = self._db.select_from_table("FLASHCARD", term=term, body=body, user_id=user_id, set_id=set_id)
+        card_id = self._db.insert_into_table("FLASHCARD", term=term, body=body, user_id=user_id, set_id=set_id)
+        # Return card object built from the new row id
+        return Card(card_id, term, body, user_id, set_id, False)
+
+    def import_cards(self, set_id: int, user_id: int, file: BinaryIO, delimiter: str = ",",
+                     batch_size: int = IMPORT_BATCH_SIZE) -> Iterator[int]:
+        logger.debug("import_cards(%s, %s, %r)", set_id, user_id, delimiter)
+        # Decode and parse the upload lazily, so only one batch is held in memory at a time
+        rows = csv.reader(codecs.iterdecode(file, "utf-8-sig"), delimiter=delimiter)
+        # Yield the number of imported cards after every batch
+        yield from self._db.insert_many("FLASHCARD", ("term", "body", "user_id", "set_id"),
+                                        self._batch_cards(rows, set_id, user_id, batch_size))
+
+    def _batch_cards(self, rows: Iterator[list[str]], set_id: int, user_id: int, batch_size: int) -> Iterator[list[tuple]]:
+        batch = []
+        for number, row in enumerate(rows):
+            # Skip blank lines and rows without both a term and a body
+            if len(row) < 2 or not row[0].strip() or not row[1].strip():
+                continue
+            # Skip a header row
+            if number == 0 and (row[0].strip().lower(), row[1].strip().lower()) in IMPORT_HEADERS:
+                continue
+            batch.append((row[0].strip(), row[1].strip(), user_id, set_id))
+            if len(batch) == batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    def export_cards(self, user_id: int, set_id: Optional[int] = None, super_id: Optional[int] = None) -> Iterator[tuple]:
+        logger.debug("export_cards(%s, %s, %s)", user_id, set_id, super_id)
+        # Narrow the export to one set or one super set, otherwise export everything the user owns
+        query, params = EXPORT_QUERY, [user_id]
+        # A single set never includes an empty super set
+        empty, empty_params = (EXPORT_EMPTY_SUPER_SETS, [user_id]) if set_id is None else (None, [])
+        if set_id is not None:
+            query += " AND SUBSET.id = ?"
+            params.append(set_id)
+        if super_id is not None:
+            query += " AND SUBSET.super_id = ?"
+            params.append(super_id)
+            if empty is not None:
+                empty += " AND SUPERSET.id = ?"
+                empty_params.append(super_id)
+        if empty is not None:
+            query = f"{query} UNION ALL {empty}"
+            params += empty_params
+        # Stream rows straight from the cursor without building Set or Card objects
+        return self._db.stream_query(query, params)
+
+    def get_deck_version(self, user_id: int, kind: str, deck_id: int) -> Optional[tuple[int, float]]:
+        logger.debug("get_deck_version(%s, %r, %s)", user_id, kind, deck_id)
+        # Version and modified time only, enough to answer a revalidation
+        info = self._db.execute_query(DECK_VERSION[kind], [deck_id, user_id])
         if not info:
             return None
-        info = info[0]
-        return Card(*info)
+        return info[0]
+
+    def get_page_version(self, user_id: int) -> tuple[int, float]:
+        logger.debug("get_page_version(%s)", user_id)
+        # Primary key lookup, a cached page is served after this single query
+        info = self._db.execute_query(PAGE_VERSION, [user_id])
+        if not info:
+            return 0, 0.0
+        return info[0]
+
+    def get_deck(self, user_id: int, kind: str, deck_id: int) -> Optional[dict]:
+        '''
+        Returns a set ("set") or a super set ("super_set") of a user with every card, as
+        {"kind", "id", "title", "version", "modified", "sets": [{"id", "title", "cards": [[id, term, body], ...]}]}
+        '''
+        logger.debug("get_deck(%s, %r, %s)", user_id, kind, deck_id)
+        rows = self._db.execute_query(DECK_PAYLOAD[kind], [deck_id, user_id])
+        if not rows:
+            return None
+        version, modified, title = rows[0][:3]
+        # Group the flat rows by set, sets without cards come back as a single row without a card
+        sets = {}
+        for _, _, _, set_id, set_title, card_id, term, body in rows:
+            if set_id is None:
+                continue
+            cards = sets.setdefault(set_id, {"id": set_id, "title": set_title, "cards": []})["cards"]
+            if card_id is not None:
+                cards.append([card_id, term, body])
+        return {"kind": kind, "id": deck_id, "title": title, "version": version, "modified": modified,
+                "sets": list(sets.values())}
+
+    def search_cards(self, user_id: int, query: str, limit: int = 20, offset: int = 0) -> list[SearchResult]:
+        logger.debug("search_cards(%s, %r, %s, %s)", user_id, query, limit, offset)
+        match = match_query(query, user_id)
+        if not match:
+            return []
+        # Rank, highlight and page in the full-text index, only the page's cards are read
+        rows = self._db.execute_query(SEARCH_QUERY, [match, limit, offset])
+        return [SearchResult(Card(*info[:5]), info[5], info[6]) for info in rows]
 
     def get_card(self, card_id: int) -> Card:
-        print(f"DEBUG::Set Handler::get_card({card_id})")
+        logger.debug("get_card(%s)", card_id)
         # Get card info
-        info = self._db.select_from_table("FLASHCARD", id=card_id)
+        info = self._db.execute_query(GET_CARD, [card_id])
         # Return card object
         if not info:
             return None
         info = info[0]
         return Card(*info)
     
+    @writes
     def edit_card(self, card_id: int, new_term: Optional[str], new_body: Optional[str]) -> Card:
-        print(f"DEBUG::Set Handler::edit_card({card_id}, \"{new_term}\", \"{new_body}\")")
+        logger.debug("edit_card(%s, %r, %r)", card_id, new_term, new_body)
         if not new_term and not new_body:
             return None
         new_vals = {}
@@ -154,17 +433,19 @@ class SetHandler:
             new_vals["term"] = new_term
         if new_body:
             new_vals["body"] = new_body
-        # Update card term and body
-        self._db.update_table("FLASHCARD", new_vals, id=card_id)
+        # Update card term and body with one statement and read the card back in the same transaction
+        with self._db.transaction():
+            self._db.update_table("FLASHCARD", new_vals, id=card_id)
+            info = self._db.select_from_table("FLASHCARD", id=card_id)
         # Return updated card object if found
-        info = self._db.select_from_table("FLASHCARD", id=card_id)
         if not info:
             return None
         info = info[0]
         return Card(*info)
     
+    @writes
     def delete_card(self, card_id: int):
-        print(f"DEBUG::Set Handler::delete_card({card_id})")
+        logger.debug("delete_card(%s)", card_id)
         # Delete card from database
         self._db.remove_from_table("FLASHCARD", id=card_id)
         # Return True if card is deleted
@@ -173,32 +454,7 @@ class SetHandler:
             return True
         return False
 
-    def study_card(self, card_id: int):
-        print(f"DEBUG::Set Handler::study_card({card_id})")
-        # Update card to studied
-        self._db.update_table("FLASHCARD", {"studied": True}, id=card_id)
-        # Return updated card object if found
-        info = self._db.select_from_table("FLASHCARD", id=card_id)
-        if not info:
-            return None
-        info = info[0]
-        return Card(*info)
-    
-    def _get_unstudied_cards(self, set_id: int) -> list[Card]:
-        print(f"DEBUG::Set Handler::get_unstudied_cards({set_id})")
-        # Get unstudied cards
-        cards = self._db.select_from_table("FLASHCARD", set_id=set_id, studied=False)
-        return [Card(*info) for info in cards]
-
-    def get_next_unstudied_card(self, card_id: int | None = None, set_id: int | None = None) -> Card:
-        print(f"DEBUG::Set Handler::get_next_unstudied_card({card_id}, {set_id})")
-        # Get unstudied cards
-        if set_id:
-            cards = self._get_unstudied_cards(set_id)
-        else:
-            cards = self._get_unstudied_cards(self.get_card(card_id).set_id)
-
-        if not cards:
-            return None
-        # Return random card
-        return random.choice(cards)
\ No newline at end of file
+class AsyncSetHandler(AsyncHandler):
+    '''SetHandler whose methods are awaited on the database pool'''
+    def __init__(self):
+        super().__init__(SetHandler())
@@ -0,0 +1,224 @@
+from functools import lru_cache
+from typing import Optional
+import logging
+import random
+import time
+
+from flashlearn.utils.database import AsyncHandler, DatabaseManager, writes
+from flashlearn.utils.scheduler import DEFAULT_PARAMS, GRADES, RESCHEDULE_CARDS, Schedule, SchedulerParams, review
+from flashlearn.models.card import Card
+from flashlearn.models.study import Review, StudyStep
+
+logger = logging.getLogger(__name__)
+
+# Cards of a set a learner should study now: reviewed cards that came due, a range scan over
+# the (user_id, set_id, due) index, followed by cards the learner never reviewed. Without
+# statistics the planner would walk all of the user's cards instead of the set's.
+DUE_CARDS = '''
+    SELECT card_id FROM CARD_STATE WHERE user_id = ?1 AND set_id = ?2 AND due <= ?3
+    UNION ALL
+    SELECT id FROM FLASHCARD INDEXED BY FLASHCARD_set_id WHERE set_id = ?2 AND user_id = ?1
+      AND NOT EXISTS (SELECT 1 FROM CARD_STATE WHERE CARD_STATE.user_id = ?1 AND CARD_STATE.card_id = FLASHCARD.id)
+'''
+
+# Card at the session's cursor. The queue's primary key is (session_id, position), so this
+# is a single index seek no matter how large the deck is.
+CURRENT_CARD = '''
+    SELECT STUDY_SESSION.id, STUDY_QUEUE.position, STUDY_SESSION.size,
+           FLASHCARD.id, FLASHCARD.term, FLASHCARD.body, FLASHCARD.user_id, FLASHCARD.set_id,
+           CARD_STATE.card_id IS NOT NULL
+    FROM STUDY_SESSION
+    JOIN STUDY_QUEUE ON STUDY_QUEUE.session_id = STUDY_SESSION.id AND STUDY_QUEUE.position >= STUDY_SESSION.position
+    JOIN FLASHCARD ON FLASHCARD.id = STUDY_QUEUE.card_id
+    LEFT JOIN CARD_STATE ON CARD_STATE.user_id = STUDY_SESSION.user_id AND CARD_STATE.card_id = FLASHCARD.id
+    WHERE STUDY_SESSION.id = ? AND STUDY_SESSION.user_id = ?
+    ORDER BY STUDY_QUEUE.position
+    LIMIT 1
+'''
+
+# Learner's state of the card queued at a position of their session, defaults for a first
+# review. Only returned while the cursor has not moved past the position, so a replayed
+# answer is not reviewed twice.
+QUEUED_STATE = '''
+    SELECT FLASHCARD.id, FLASHCARD.set_id, COALESCE(CARD_STATE.ease, 2.5),
+           COALESCE(CARD_STATE.interval, 0), COALESCE(CARD_STATE.repetitions, 0)
+    FROM STUDY_SESSION
+    JOIN STUDY_QUEUE ON STUDY_QUEUE.session_id = STUDY_SESSION.id
+    JOIN FLASHCARD ON FLASHCARD.id = STUDY_QUEUE.card_id
+    LEFT JOIN CARD_STATE ON CARD_STATE.user_id = STUDY_SESSION.user_id AND CARD_STATE.card_id = FLASHCARD.id
+    WHERE STUDY_SESSION.id = ?1 AND STUDY_SESSION.user_id = ?2 AND STUDY_QUEUE.position = ?3
+      AND STUDY_SESSION.position <= ?3
+'''
+
+# Writes a learner's state of a card, the row is created by the first review
+SAVE_STATE = '''
+    INSERT INTO CARD_STATE (user_id, card_id, set_id, ease, interval, repetitions, due, reviewed)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT (user_id, card_id) DO UPDATE SET
+        ease = excluded.ease, interval = excluded.interval, repetitions = excluded.repetitions,
+        due = excluded.due, reviewed = excluded.reviewed
+'''
+
+# Most reviews accepted in one batch, keeps the ownership query's IN list well below
+# SQLite's variable limit
+MAX_REVIEW_BATCH = 1000
+# Seconds a client's clock may run ahead of the server's
+CLOCK_SKEW = 300
+
+@lru_cache(maxsize=64)
+def owned_states_query(size: int) -> str:
+    '''
+    Ownership check and current state of a batch of cards in one query: only cards of the
+    user come back, with their review state or the defaults of a new card
+    '''
+    return f'''
+        SELECT FLASHCARD.id, FLASHCARD.set_id, COALESCE(CARD_STATE.ease, 2.5), COALESCE(CARD_STATE.interval, 0),
+               COALESCE(CARD_STATE.repetitions, 0), COALESCE(CARD_STATE.due, 0), COALESCE(CARD_STATE.reviewed, 0)
+        FROM FLASHCARD
+        LEFT JOIN CARD_STATE ON CARD_STATE.user_id = ?1 AND CARD_STATE.card_id = FLASHCARD.id
+        WHERE FLASHCARD.user_id = ?1 AND FLASHCARD.id IN ({', '.join('?' * size)})
+    '''
+
+# Moves the cursor past an answered position. Replaying an old answer never moves it back.
+ADVANCE_SESSION = '''
+    UPDATE STUDY_SESSION SET position = ?3 + 1
+    WHERE id = ?1 AND user_id = ?2 AND position <= ?3
+'''
+
+# Parameters the stored due dates were computed with, a single row
+STORED_PARAMS = "SELECT min_ease, interval_modifier, max_interval FROM SCHEDULER_PARAMS WHERE id = 1"
+SAVE_PARAMS = '''
+    INSERT INTO SCHEDULER_PARAMS (id, min_ease, interval_modifier, max_interval) VALUES (1, ?, ?, ?)
+    ON CONFLICT (id) DO UPDATE SET
+        min_ease = excluded.min_ease, interval_modifier = excluded.interval_modifier, max_interval = excluded.max_interval
+'''
+
+# Forgets a learner's progress on a set, one statement over the (user_id, set_id, due) index
+RESET_SET = "DELETE FROM CARD_STATE WHERE user_id = ? AND set_id = ?"
+
+class StudyHandler:
+    '''
+    Server-side study sessions. A session shuffles the due cards of a set once when it
+    starts and keeps a cursor into that order, so every answer costs the same few indexed
+    statements instead of re-sampling the deck. Answers are scheduled with SM-2.
+    '''
+    def __init__(self):
+        self._db = DatabaseManager()
+
+    @writes
+    def start_session(self, user_id: int, set_id: int, now: Optional[float] = None) -> Optional[int]:
+        '''Returns the id of a new session over the due cards of a set, None if none are due'''
+        logger.debug("start_session(%s, %s)", user_id, set_id)
+        now = time.time() if now is None else now
+        # Shuffle the due cards once, only ids leave the database
+        card_ids = [row[0] for row in self._db.execute_query(DUE_CARDS, (user_id, set_id, now))]
+        if not card_ids:
+            return None
+        random.shuffle(card_ids)
+        with self._db.transaction():
+            # A user studies one deck at a time, older queues are dropped with their session
+            self._db.remove_from_table("STUDY_SESSION", user_id=user_id)
+            session_id = self._db.insert_into_table("STUDY_SESSION", user_id=user_id, set_id=set_id,
+                                                    position=0, size=len(card_ids), created=now)
+            list(self._db.insert_many("STUDY_QUEUE", ("session_id", "position", "card_id"),
+                                      [[(session_id, position, card_id) for position, card_id in enumerate(card_ids)]]))
+        return session_id
+
+    def current(self, session_id: int, user_id: int) -> Optional[StudyStep]:
+        '''Returns the card at the session's cursor, None once the session is finished'''
+        logger.debug("current(%s, %s)", session_id, user_id)
+        rows = self._db.execute_query(CURRENT_CARD, (session_id, user_id))
+        if not rows:
+            return None
+        session_id, position, size, *card = rows[0]
+        return StudyStep(session_id, position, size, Card(*card))
+
+    @writes
+    def answer(self, session_id: int, user_id: int, position: int, grade: Optional[int],
+               now: Optional[float] = None) -> Optional[StudyStep]:
+        '''
+        Records the answer for a queue position and returns the next card in the same round trip.
+        grade is the SM-2 grade from 0 to 5, None skips the card without reviewing it.
+        '''
+        logger.debug("answer(%s, %s, %s, %s)", session_id, user_id, position, grade)
+        now = time.time() if now is None else now
+        with self._db.transaction():
+            if grade is not None:
+                rows = self._db.execute_query(QUEUED_STATE, (session_id, user_id, position))
+                if rows:
+                    card_id, set_id, ease, interval, repetitions = rows[0]
+                    schedule = review(Schedule(ease, interval, repetitions), grade, now)
+                    self._db.execute_query(SAVE_STATE, (user_id, card_id, set_id, schedule.ease, schedule.interval,
+                                                        schedule.repetitions, schedule.due, schedule.reviewed))
+            self._db.execute_query(ADVANCE_SESSION, (session_id, user_id, position))
+            return self.current(session_id, user_id)
+
+    @writes
+    def apply_reviews(self, user_id: int, reviews: list[Review], now: Optional[float] = None) -> Optional[int]:
+        '''
+        Applies a batch of reviews in one transaction and returns how many were applied, None
+        without applying any if a card is not the user's. Reviews are replayed per card in
+        timestamp order. Reviews not newer than the card's last review were already applied
+        by an earlier sync and are skipped, so a client can safely resend a batch. Reviews
+        dated further in the future than CLOCK_SKEW come from a broken clock and are skipped too.
+        '''
+        logger.debug("apply_reviews(%s, %s reviews)", user_id, len(reviews))
+        now = time.time() if now is None else now
+        card_ids = list({review.card_id for review in reviews})
+        if not card_ids:
+            return 0
+        with self._db.transaction() as connection:
+            rows = self._db.execute_query(owned_states_query(len(card_ids)), [user_id, *card_ids])
+            if len(rows) != len(card_ids):
+                return None
+            sets = {row[0]: row[1] for row in rows}
+            schedules = {row[0]: Schedule(*row[2:]) for row in rows}
+            changed = set()
+            applied = 0
+            for item in sorted(reviews, key=lambda item: item.timestamp):
+                schedule = schedules[item.card_id]
+                if item.timestamp <= schedule.reviewed or item.timestamp > now + CLOCK_SKEW:
+                    continue
+                schedules[item.card_id] = review(schedule, GRADES[item.outcome], item.timestamp)
+                changed.add(item.card_id)
+                applied += 1
+            # One executemany writes the final state of every changed card
+            connection.executemany(SAVE_STATE, [(user_id, card_id, sets[card_id], schedules[card_id].ease,
+                                                 schedules[card_id].interval, schedules[card_id].repetitions,
+                                                 schedules[card_id].due, schedules[card_id].reviewed)
+                                                for card_id in changed])
+        return applied
+
+    @writes
+    def apply_params(self, params: SchedulerParams = DEFAULT_PARAMS) -> bool:
+        '''
+        Recomputes the due dates of every reviewed card when params differ from the ones they
+        were computed with, returns whether it did. Run at startup, so changed FLASHLEARN_SM2_*
+        variables take effect on the next restart.
+        '''
+        logger.debug("apply_params(%s)", params)
+        values = (params.min_ease, params.interval_modifier, params.max_interval)
+        # Read first, a restart with unchanged parameters takes no write lock
+        stored = self._db.execute_query(STORED_PARAMS)
+        if stored and stored[0] == values:
+            return False
+        with self._db.transaction():
+            # Check again under the write lock, another worker may have rescheduled meanwhile
+            stored = self._db.execute_query(STORED_PARAMS)
+            if stored and stored[0] == values:
+                return False
+            logger.info("Rescheduling reviewed cards for %s", params)
+            self._db.execute_query(RESCHEDULE_CARDS, values)
+            self._db.execute_query(SAVE_PARAMS, values)
+        return True
+
+    @writes
+    def reset_progress(self, user_id: int, set_id: int):
+        '''Forgets every review of a learner in a set, its cards become new again'''
+        logger.debug("reset_progress(%s, %s)", user_id, set_id)
+        self._db.execute_query(RESET_SET, (user_id, set_id))
+
+class AsyncStudyHandler(AsyncHandler):
+    '''StudyHandler whose methods are awaited on the database pool'''
+    def __init__(self):
+        super().__init__(StudyHandler())
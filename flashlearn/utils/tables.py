@@ -0,0 +1,73 @@
+from functools import lru_cache
+from typing import Union
+
+# A WHERE term is either a column compared with IS, or (column, n) for an IN list of n values
+Condition = Union[str, tuple[str, int]]
+
+class Table:
+    '''
+    Whitelisted table that builds its SQL once per statement shape.
+
+    Sample usage:
+      ```GET_CARD = FLASHCARD.select(where=("id",))```
+    this will return the fixed text "SELECT * FROM FLASHCARD WHERE id IS ?". Names are checked
+    against the table's columns when the statement is first built, and every later call with the
+    same shape returns the same string, so sqlite3's statement cache gets a hit.
+    '''
+    def __init__(self, name: str, columns: tuple[str, ...]):
+        self.name = name
+        self.columns = columns
+
+    def _check(self, columns: tuple[str, ...]) -> tuple[str, ...]:
+        for column in columns:
+            if column not in self.columns:
+                raise ValueError(f"Unknown column {column!r} in table {self.name}")
+        return columns
+
+    def _where(self, where: tuple[Condition, ...]) -> str:
+        if not where:
+            return ""
+        conditions = []
+        for condition in where:
+            if isinstance(condition, tuple):
+                column, size = condition
+                conditions.append(f"{self._check((column,))[0]} IN ({', '.join('?' * size)})")
+            else:
+                conditions.append(f"{self._check((condition,))[0]} IS ?")
+        return f" WHERE {' AND '.join(conditions)}"
+
+    @lru_cache(maxsize=256)
+    def select(self, columns: tuple[str, ...] = (), where: tuple[Condition, ...] = ()) -> str:
+        selected = ', '.join(self._check(columns)) if columns else '*'
+        return f"SELECT {selected} FROM {self.name}{self._where(where)}"
+
+    @lru_cache(maxsize=64)
+    def insert(self, columns: tuple[str, ...]) -> str:
+        return f"INSERT INTO {self.name} ({', '.join(self._check(columns))}) VALUES ({', '.join('?' * len(columns))})"
+
+    @lru_cache(maxsize=64)
+    def update(self, columns: tuple[str, ...], key: str) -> str:
+        assignments = ', '.join(f"{column} = ?" for column in self._check(columns))
+        return f"UPDATE {self.name} SET {assignments} WHERE {self._check((key,))[0]} = ?"
+
+    @lru_cache(maxsize=16)
+    def delete(self, key: str) -> str:
+        return f"DELETE FROM {self.name} WHERE {self._check((key,))[0]} = ?"
+
+# Column whitelist, keep in sync with flashlearn/utils/migrations.py
+USER = Table("USER", ("id", "email", "password", "name", "version", "modified", "session_epoch"))
+SUPERSET = Table("SUPERSET", ("id", "title", "user_id", "version", "modified"))
+SUBSET = Table("SUBSET", ("id", "title", "user_id", "super_id", "version", "modified"))
+FLASHCARD = Table("FLASHCARD", ("id", "term", "body", "user_id", "set_id"))
+CARD_STATE = Table("CARD_STATE", ("user_id", "card_id", "set_id", "ease", "interval", "repetitions", "due", "reviewed"))
+SESSION_KEY = Table("SESSION_KEY", ("id", "secret", "created"))
+STUDY_SESSION = Table("STUDY_SESSION", ("id", "user_id", "set_id", "position", "size", "created"))
+STUDY_QUEUE = Table("STUDY_QUEUE", ("session_id", "position", "card_id"))
+SCHEDULER_PARAMS = Table("SCHEDULER_PARAMS", ("id", "min_ease", "interval_modifier", "max_interval"))
+
+TABLES = {table.name: table for table in (USER, SUPERSET, SUBSET, FLASHCARD, CARD_STATE, SESSION_KEY, STUDY_SESSION, STUDY_QUEUE, SCHEDULER_PARAMS)}
+
+def get_table(name: str) -> Table:
+    if name not in TABLES:
+        raise ValueError(f"Unknown table {name!r}")
+    return TABLES[name]
@@ -1,52 +1,99 @@
-from flashlearn.utils.database import DatabaseManager
+from typing import Optional
+import logging
+import secrets
+import time
+
+from flashlearn.utils.database import DatabaseManager, run_in_pool, run_in_writer
 from flashlearn.models.user import User
-import hashlib
+from flashlearn.security.hash import check_hash_async, get_hash_async, needs_rehash
+from flashlearn.security.token import keyring, KEY_ROTATION_AGE, SESSION_TTL
+from flashlearn.utils.tables import USER, SESSION_KEY
+
+# Columns User is built from, the password hash is only read to verify it
+USER_COLUMNS = ("id", "email", "password", "name", "session_epoch")
+# Prepared statement for the user lookup on token refresh and password changes
+GET_USER = USER.select(USER_COLUMNS, where=("email",))
+# Login accepts an email or a user name, both are unique indexes and email matches come first
+LOGIN_QUERY = f"{USER.select(USER_COLUMNS)} WHERE email = ? UNION ALL {USER.select(USER_COLUMNS)} WHERE name = ?"
+# A new password ends every other session, their tokens carry the previous epoch
+CHANGE_PASSWORD = "UPDATE USER SET password = ?, session_epoch = session_epoch + 1 WHERE id = ?"
+# Bound directly rather than through insert_into_table, the secret must never reach a log line
+INSERT_SESSION_KEY = SESSION_KEY.insert(("secret", "created"))
+# Keys that can no longer have signed an unexpired token
+PRUNE_SESSION_KEYS = "DELETE FROM SESSION_KEY WHERE created < ?"
+
+logger = logging.getLogger(__name__)
+
+def load_session_keys() -> dict[int, tuple[bytes, float]]:
+    '''Returns every session key, first creating a new one if the newest is due for rotation'''
+    db = DatabaseManager()
+    now = time.time()
+    # Read first, the write lock is only taken when a rotation is due
+    keys = db.execute_query(SESSION_KEY.select())
+    if not keys or max(created for _, _, created in keys) < now - KEY_ROTATION_AGE:
+        with db.transaction():
+            # Check again under the lock, another worker may have rotated meanwhile
+            keys = db.execute_query(SESSION_KEY.select())
+            if not keys or max(created for _, _, created in keys) < now - KEY_ROTATION_AGE:
+                logger.info("Rotating session key")
+                db.execute_query(INSERT_SESSION_KEY, [secrets.token_bytes(32), now])
+                db.execute_query(PRUNE_SESSION_KEYS, [now - KEY_ROTATION_AGE - SESSION_TTL])
+                keys = db.execute_query(SESSION_KEY.select())
+    return {key_id: (secret, created) for key_id, secret, created in keys}
+
+keyring.loader = load_session_keys
 
 class UserHandler:
     def __init__(self):
         self._db = DatabaseManager()
 
-    def login(self, user: str, password: str) -> User:
-        print(f"DEBUG::User Handler::login({user}, {password})")
-        hashed_password = hashlib.sha256(password.encode()).hexdigest()
-        info = self._db.select_from_table("USER", email=user, password=hashed_password)
-        if not info:
-            info = self._db.select_from_table("USER", name=user, password=hashed_password)
-        if not info:
+    async def _verify(self, rows: list[tuple], password: str) -> Optional[tuple]:
+        # Return the first row whose hash matches, checked in the hash pool
+        for info in rows:
+            if await check_hash_async(password, info[2]):
+                return info
+        return None
+
+    async def login(self, user: str, password: str) -> Optional[User]:
+        logger.debug("login(%s)", user)
+        # Salted hashes cannot be matched in SQL, fetch by identifier in one query and verify after
+        rows = await run_in_pool(self._db.execute_query, LOGIN_QUERY, [user, user])
+        info = await self._verify(rows, password)
+        if info is None:
             return None
-        info = info[0]
-        print(f"DEBUG::User Handler::login::info: {info}")
-        return User(info[0], info[1], info[3])
+        logger.debug("login::user id: %s", info[0])
+        # Upgrade legacy SHA-256 rows and outdated cost parameters while the password is at hand
+        if needs_rehash(info[2]):
+            hashed_password = await get_hash_async(password)
+            await run_in_writer(self._db.update_table, "USER", { "password" : hashed_password }, id=info[0])
+        return User(info[0], info[1], info[3], info[4])
     
-    def register(self, user: str, password: str, email: str):
-        print(f"DEBUG::User Handler::register({user}, {password}, {email})")
-        hashed_password = hashlib.sha256(password.encode()).hexdigest()
+    async def register(self, user: str, password: str, email: str) -> Optional[User]:
+        logger.debug("register(%s, %s)", user, email)
+        hashed_password = await get_hash_async(password)
         # Check if user already exists
         try:
-            self._db.insert_into_table("USER", name=user, password=hashed_password, email=email)
+            user_id = await run_in_writer(self._db.insert_into_table, "USER", name=user, password=hashed_password, email=email)
         except Exception as e:
-            print(e)
-            return None
-
-        info = self.login(user, password)
-        if not info:
+            logger.info("Failed to register %s: %s", email, e)
             return None
-        return info
+        return User(user_id, email, user)
     
     def get_user(self, email: str) -> User:
-        print(f"DEBUG::User Handler::get_user({email})")
-        info = self._db.select_from_table("USER", email=email)
+        logger.debug("get_user(%s)", email)
+        info = self._db.execute_query(GET_USER, [email])
         if not info:
             return None
         info = info[0]
-        return User(info[0], info[1], info[3])
+        return User(info[0], info[1], info[3], info[4])
     
-    def change_password(self, email: str, password: str, new_pass: str) -> bool:
-        print(f"DEBUG::User Handler::change_password({email}, {password}, {new_pass})")
-        hashed_password = hashlib.sha256(new_pass.encode()).hexdigest()
-        if self.login(email, password) is None:
-            return False
-        self._db.update_table("USER", { "password" : hashed_password }, email=email)
-        if self.login(email, new_pass) is None:
-            raise Exception("Password change failed")
-        return True
\ No newline at end of file
+    async def change_password(self, email: str, password: str, new_pass: str) -> Optional[User]:
+        '''Returns the user with their new session epoch, None if password does not match'''
+        logger.debug("change_password(%s)", email)
+        rows = await run_in_pool(self._db.execute_query, GET_USER, [email])
+        info = await self._verify(rows, password)
+        if info is None:
+            return None
+        hashed_password = await get_hash_async(new_pass)
+        await run_in_writer(self._db.execute_query, CHANGE_PASSWORD, [hashed_password, info[0]])
+        return User(info[0], info[1], info[3], info[4] + 1)
@@ -0,0 +1,63 @@
+import sqlite3
+
+import pytest
+
+from flashlearn.utils.database import DatabaseManager
+from flashlearn.utils.migrations import MIGRATIONS
+from flashlearn.utils.set_handler import SetHandler
+
+
+@pytest.fixture
+def legacy_db(tmp_path, monkeypatch):
+    # A database as the original schema left it, with the data later migrations repair
+    path = str(tmp_path / "legacy.db")
+    connection = sqlite3.connect(path)
+    for statement in MIGRATIONS[0]:
+        connection.execute(statement)
+    connection.executemany("INSERT INTO USER VALUES (?, ?, ?, ?)", [
+        (1, "a@example.com", "", "al"),
+        (2, "b@example.com", "", "al"),  # Duplicate name
+        (3, "c@example.com", "", "al-2"),  # Already holds the duplicate's first new name
+    ])
+    connection.execute("INSERT INTO SUPERSET VALUES (1, 'Super', 1)")
+    connection.executemany("INSERT INTO SUBSET VALUES (?, ?, ?, ?)", [
+        (1, "Top", 1, None),
+        (2, "Sub", 1, 1),
+        (3, "Orphan", 1, 9),  # Super set was deleted
+    ])
+    connection.executemany("INSERT INTO FLASHCARD VALUES (?, ?, ?, ?, ?, ?)", [
+        (1, "zebra", "Body 1", "a@example.com", 1, False),  # Owner stored by email
+        (2, "Term 2", "Body 2", 1, 2, True),  # Studied
+        (3, "Term 3", "Body 3", 1, 3, False),  # In the orphaned set
+        (4, "Term 4", "Body 4", 1, 7, False),  # Set was deleted
+    ])
+    connection.commit()
+    connection.close()
+    monkeypatch.setattr(DatabaseManager, "path", path)
+    monkeypatch.setattr(DatabaseManager, "_instance", None)
+    db = DatabaseManager()
+    yield db
+    db.close_connection()
+
+
+def test_migrates_to_latest_version(legacy_db):
+    versions = legacy_db.execute_query("SELECT version FROM SCHEMA_VERSION ORDER BY version")
+    assert versions == [(number,) for number in range(1, len(MIGRATIONS) + 1)]
+    assert legacy_db.execute_query("PRAGMA foreign_key_check") == []
+
+
+def test_migrated_rows(legacy_db):
+    assert legacy_db.execute_query("SELECT id, name FROM USER ORDER BY id") == [(1, "al"), (2, "al-2-2"), (3, "al-2")]
+    assert legacy_db.execute_query("SELECT id, super_id FROM SUBSET ORDER BY id") == [(1, None), (2, 1)]
+    assert legacy_db.execute_query("SELECT id, user_id, set_id FROM FLASHCARD ORDER BY id") == [(1, 1, 1), (2, 1, 2)]
+    assert legacy_db.execute_query("SELECT user_id, card_id, set_id FROM CARD_STATE") == [(1, 2, 2)]
+
+
+def test_migrated_cards_are_searchable(legacy_db):
+    assert [result.card.id for result in SetHandler().search_cards(1, "zebra")] == [1]
+    assert SetHandler().search_cards(2, "zebra") == []
+
+
+def test_migrating_again_changes_nothing(legacy_db):
+    legacy_db.create_tables()
+    assert legacy_db.execute_query("SELECT COUNT(*) FROM SCHEMA_VERSION") == [(len(MIGRATIONS),)]
@@ -0,0 +1,71 @@
+import pytest
+
+from flashlearn.models.sets import Set, SuperSet
+from flashlearn.utils.database import DatabaseManager
+from flashlearn.utils.set_handler import SetHandler
+
+
+@pytest.fixture
+def handler(tmp_path, monkeypatch):
+    monkeypatch.setattr(DatabaseManager, "path", str(tmp_path / "test.db"))
+    monkeypatch.setattr(DatabaseManager, "_instance", None)
+    handler = SetHandler()
+    handler._db.insert_into_table("USER", email="test@example.com", password="", name="test")
+    yield handler
+    handler._db.close_connection()
+
+
+def add_sets(handler: SetHandler, count: int):
+    # Half top level sets, half super sets holding one set each, every set with two cards
+    for number in range(count):
+        if number % 2:
+            super_id = handler.create_super_set(f"Super {number}", 1).id
+            set_id = handler.create_set(f"Sub {number}", 1, super_id).id
+        else:
+            set_id = handler.create_set(f"Set {number}", 1).id
+        for card in range(2):
+            handler.add_card_to_set(set_id, 1, f"Term {card}", f"Body {card}")
+
+
+def count_queries(handler: SetHandler, user_id: int) -> int:
+    statements = []
+    handler._db.connection.set_trace_callback(statements.append)
+    try:
+        handler.get_user_sets(user_id)
+    finally:
+        handler._db.connection.set_trace_callback(None)
+    return len(statements)
+
+
+def test_get_user_sets_query_count_is_constant(handler):
+    add_sets(handler, 2)
+    few = count_queries(handler, 1)
+    add_sets(handler, 18)
+    assert count_queries(handler, 1) == few
+
+
+def test_get_user_sets_loads_every_set(handler):
+    add_sets(handler, 20)
+    sets = handler.get_user_sets(1)
+    assert len(sets) == 20
+    loaded = [item for item in sets if isinstance(item, Set)] + [item.sets[0] for item in sets if isinstance(item, SuperSet)]
+    assert all(len(item.cards) == 2 for item in loaded)
+
+
+def test_sets_are_only_read_by_their_owner(handler):
+    add_sets(handler, 2)
+    handler._db.insert_into_table("USER", email="other@example.com", password="", name="other")
+    assert handler.get_set(1, 1).id == 1
+    assert handler.get_set(1, 2) is None
+    assert handler.get_super_set(1, 1).id == 1
+    assert handler.get_super_set(1, 2) is None
+
+
+def test_export_includes_empty_super_sets(handler):
+    add_sets(handler, 2)
+    empty_id = handler.create_super_set("Empty", 1).id
+    rows = list(handler.export_cards(1))
+    assert (empty_id, "Empty", None, None, None, None, None, 0) in rows
+    assert len(rows) == 5
+    assert list(handler.export_cards(1, super_id=empty_id)) == [(empty_id, "Empty", None, None, None, None, None, 0)]
+    assert all(row[2] == 1 for row in handler.export_cards(1, set_id=1))
@@ -0,0 +1,70 @@
+import time
+
+import pytest
+
+from flashlearn.models.user import User
+from flashlearn.security import token
+from flashlearn.security.token import KeyRing, create_token, verify_token
+
+
+@pytest.fixture
+def keys(monkeypatch):
+    # In-memory keys instead of SESSION_KEY, loads counts how often the ring asked for them
+    keys = {1: (b"a" * 32, time.time())}
+    loads = []
+
+    def loader():
+        loads.append(time.monotonic())
+        return dict(keys)
+
+    monkeypatch.setattr(token, "keyring", KeyRing(loader))
+    token.verified_tokens.clear()
+    yield keys, loads
+    token.verified_tokens.clear()
+
+
+def sign(claims: dict) -> str:
+    return token.keyring.sign(claims)
+
+
+def test_sign_and_verify(keys):
+    user = User(1, "test@example.com", "test", 3)
+    assert verify_token(create_token(user)) == user
+
+
+def test_expired_token(keys):
+    assert verify_token(create_token(User(1, "test@example.com", "test"), ttl=-1)) is None
+
+
+def test_stale_token_needs_epoch_check(keys):
+    now = int(time.time())
+    stale = sign({"id": 1, "email": "test@example.com", "name": "test", "epoch": 2,
+                  "iat": now - token.TOKEN_TTL - 1, "exp": now + 60})
+    assert verify_token(stale) is None
+    assert verify_token(stale, max_age=None) == User(1, "test@example.com", "test", 2)
+
+
+def test_forged_signature(keys):
+    key_id, payload, _ = create_token(User(1, "test@example.com", "test")).split(".")
+    forged = KeyRing(lambda: {1: (b"b" * 32, time.time())}).sign({"id": 2, "email": "x", "name": "x", "exp": 2 ** 40})
+    assert verify_token(forged) is None
+    assert verify_token(f"{key_id}.{payload}.{forged.rsplit('.', 1)[1]}") is None
+
+
+def test_unknown_key_id(keys):
+    _, loads = keys
+    key_id, payload, signature = create_token(User(1, "test@example.com", "test")).split(".")
+    assert verify_token(f"99.{payload}.{signature}") is None
+    # Unknown ids reload the keys at most once per RELOAD_INTERVAL
+    loaded = len(loads)
+    assert verify_token(f"98.{payload}.{signature}") is None
+    assert len(loads) == loaded
+
+
+def test_key_created_by_another_worker(keys, monkeypatch):
+    keys, _ = keys
+    monkeypatch.setattr(token, "RELOAD_INTERVAL", 0)
+    create_token(User(1, "test@example.com", "test"))
+    keys[2] = (b"c" * 32, time.time() + 1)
+    other = KeyRing(lambda: dict(keys)).sign({"id": 1, "email": "test@example.com", "name": "test", "iat": int(time.time()), "exp": 2 ** 40})
+    assert verify_token(other) == User(1, "test@example.com", "test")